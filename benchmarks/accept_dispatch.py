@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+
+# This file is part of the Rocket Web Server
+# Copyright (c) 2012 Timothy Farrell
+
+"""\
+Compare how many short-lived connections per second Rocket serves when a
+Listener thread queues each connection for a Worker and when idle Workers take
+turns accepting connections themselves (leader_follower=True).  Each
+connection makes one HTTP/1.0 request.  Run it from the source distribution::
+
+  python benchmarks/accept_dispatch.py [connections] [clients]
+"""
+
+# Import System Modules
+import os
+import sys
+import time
+import socket
+from threading import Thread
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+# Import Custom Modules
+from rocket import Rocket, b
+
+# Constants
+ADDR = ('127.0.0.1', 47444)
+REQUEST = b('GET / HTTP/1.0\r\n\r\n')
+
+def app(environ, start_response):
+    start_response('200 OK', [('Content-Type', 'text/plain'),
+                              ('Content-Length', '2')])
+    return [b('OK')]
+
+def connect(count):
+    for x in range(count):
+        sock = socket.create_connection(ADDR)
+        sock.sendall(REQUEST)
+        while sock.recv(65536):
+            pass
+        sock.close()
+
+def run(label, count, clients, **kwargs):
+    server = Rocket(ADDR,
+                    'wsgi',
+                    {'wsgi_app': app},
+                    min_threads=clients + 2,
+                    handle_signals=False,
+                    **kwargs)
+    server.start(background=True)
+
+    try:
+        # Warm up
+        connect(10)
+
+        threads = [Thread(target=connect, args=(count // clients,))
+                   for x in range(clients)]
+        start = time.time()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        elapsed = time.time() - start
+    finally:
+        server.stop()
+
+    total = (count // clients) * clients
+    print('%-16s %8.1f connections/sec' % (label, total / elapsed))
+
+def main(count=5000, clients=4):
+    run('listener queue', count, clients)
+    run('leader/follower', count, clients, leader_follower=True)
+
+if __name__ == '__main__':
+    main(*[int(x) for x in sys.argv[1:3]])
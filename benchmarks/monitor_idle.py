@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+
+# This file is part of the Rocket Web Server
+# Copyright (c) 2012 Timothy Farrell
+
+"""\
+Measure how long the connection Monitor takes to hand a readable connection
+back to the active queue while it is also watching many idle connections.  Run
+it from the source distribution::
+
+  python benchmarks/monitor_idle.py [idle_connections ...]
+"""
+
+# Import System Modules
+import os
+import sys
+import time
+import socket
+try:
+    from queue import Queue
+except ImportError:
+    from Queue import Queue
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+# Import Custom Modules
+from rocket import b
+from rocket.monitor import Monitor, MonitorQueue
+from rocket.connection import Connection
+
+# Constants
+SAMPLES = 200
+
+class FakeThreadPool(object):
+    def dynamic_resize(self):
+        pass
+
+def park(monitor_queue, count):
+    pairs = list()
+    for x in range(count):
+        server, client = socket.socketpair()
+        conn = Connection((server, ('127.0.0.1', x)), 0)
+        monitor_queue.put(conn)
+        pairs.append((conn, client))
+    return pairs
+
+def run(idle):
+    active_queue = Queue()
+    monitor_queue = MonitorQueue()
+    monitor = Monitor(monitor_queue, active_queue, 0, FakeThreadPool())
+    monitor.daemon = True
+    monitor.start()
+
+    pairs = park(monitor_queue, idle + SAMPLES)
+    while len(monitor.connections) < len(pairs):
+        time.sleep(0.01)
+
+    # Each sample wakes a different parked connection.
+    elapsed = 0.0
+    for conn, client in pairs[-SAMPLES:]:
+        start = time.time()
+        client.send(b('x'))
+        active_queue.get()
+        elapsed += time.time() - start
+
+    monitor.stop()
+    monitor.join()
+    for conn, client in pairs:
+        conn.close()
+        client.close()
+
+    print('%6i idle  %8.3f ms per dispatch' % (idle, elapsed * 1000 / SAMPLES))
+
+def main(*counts):
+    for idle in counts or (100, 1000, 5000):
+        run(idle)
+
+if __name__ == '__main__':
+    main(*[int(x) for x in sys.argv[1:]])
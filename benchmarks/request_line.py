@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+
+# This file is part of the Rocket Web Server
+# Copyright (c) 2012 Timothy Farrell
+
+"""\
+Compare the bytes request-line parser with the regular expression Rocket used
+before it.  Run it from the source distribution::
+
+  python benchmarks/request_line.py [iterations]
+"""
+
+# Import System Modules
+import os
+import re
+import sys
+import timeit
+try:
+    from urllib import unquote
+except ImportError:
+    from urllib.parse import unquote
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+# Import Custom Modules
+from rocket import b, PY3K
+from rocket.worker import parse_request_line, re_SLASH
+
+# Constants
+LINES = [
+    b('GET / HTTP/1.1'),
+    b('GET /static/css/site.css HTTP/1.1'),
+    b('GET /search?q=rocket&page=2 HTTP/1.1'),
+    b('POST /api/v1/items/42%2Fdraft HTTP/1.1'),
+    b('GET http://example.com/file%201.html HTTP/1.0'),
+]
+re_REQUEST_LINE = re.compile(r"""^
+(?P<method>OPTIONS|GET|HEAD|POST|PUT|DELETE|TRACE|CONNECT)   # Request Method
+\                                                            # (single space)
+(
+    (?P<scheme>[^:/]+)                                       # Scheme
+    (://)  #
+    (?P<host>[^/]+)                                          # Host
+)? #
+(?P<path>(\*|/[^ \?]*))                                      # Path
+(\? (?P<query_string>[^ ]*))?                                # Query String
+\                                                            # (single space)
+(?P<protocol>HTTPS?/1\.[01])                                 # Protocol
+$
+""", re.X)
+
+def parse_with_regex(line):
+    # What Worker.read_request_line() did before
+    if PY3K:
+        line = line.decode('ISO-8859-1')
+    line = line.strip()
+
+    req = re_REQUEST_LINE.match(line).groupdict()
+    for k,v in req.items():
+        if not v:
+            req[k] = ""
+        if k == 'path':
+            req['path'] = r'%2F'.join([unquote(x) for x in re_SLASH.split(v)])
+    return req
+
+def run(label, parse, iterations):
+    elapsed = timeit.timeit(lambda: [parse(l) for l in LINES],
+                            number=iterations)
+    per_line = elapsed / (iterations * len(LINES)) * 1000000
+    print('%-8s %8.2f us per request line' % (label, per_line))
+    return per_line
+
+def main(iterations=20000):
+    for line in LINES:
+        assert parse_with_regex(line) == parse_request_line(line), line
+
+    before = run('regex', parse_with_regex, iterations)
+    after = run('bytes', parse_request_line, iterations)
+    print('%.1fx faster' % (before / after))
+
+if __name__ == '__main__':
+    main(*[int(x) for x in sys.argv[1:2]])
@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+
+# This file is part of the Rocket Web Server
+# Copyright (c) 2012 Timothy Farrell
+
+"""\
+Compare building a response's header block with wsgiref's Headers class, the
+way WSGIWorker.send_headers() did before, and with the encoded header lines
+Rocket builds now.  Run it from the source distribution::
+
+  python benchmarks/response_headers.py [iterations]
+"""
+
+# Import System Modules
+import os
+import sys
+import timeit
+try:
+    from queue import Queue
+except ImportError:
+    from Queue import Queue
+from wsgiref.headers import Headers
+from email.utils import formatdate
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+# Import Custom Modules
+from rocket import b, HTTP_SERVER_SOFTWARE
+from rocket.methods.wsgi import WSGIWorker
+
+# Constants
+STATUS = '200 OK'
+RESPONSES = [
+    [('Content-Type', 'text/plain'), ('Content-Length', '2')],
+    [('Content-Type', 'application/json')],
+    [('Content-Type', 'text/html; charset=utf-8'),
+     ('Cache-Control', 'no-cache'),
+     ('Set-Cookie', 'session=0123456789abcdef; Path=/; HttpOnly'),
+     ('X-Frame-Options', 'DENY'),
+     ('Vary', 'Accept-Encoding')],
+]
+
+def build_with_headers(response_headers, body=b('OK')):
+    # What WSGIWorker.send_headers() did before
+    h_set = Headers(list(response_headers))
+    h_set.get('transfer-encoding', '').lower() == 'chunked'
+    if not 'date' in h_set:
+        h_set['Date'] = formatdate(usegmt=True)
+    if not 'server' in h_set:
+        h_set['Server'] = HTTP_SERVER_SOFTWARE
+    if not 'content-length' in h_set:
+        int(STATUS.split(' ')[0])
+        h_set['Content-Length'] = str(len(body))
+    if 'connection' not in h_set:
+        h_set['Connection'] = 'keep-alive'
+    h_set.get('connection', '') == 'close'
+    return b('HTTP/1.1 %s\r\n%s' % (STATUS, str(h_set)))
+
+def app(environ, start_response):
+    pass
+
+worker = WSGIWorker({'server_software': HTTP_SERVER_SOFTWARE, 'wsgi_app': app},
+                    Queue(), Queue())
+worker.environ = {'SERVER_PROTOCOL': 'HTTP/1.1'}
+worker.protocol = 'HTTP/1.1'
+
+def build_encoded(response_headers, body=b('OK')):
+    # What WSGIWorker does now
+    worker.header_data = None
+    worker.out_buffer = []
+    worker.start_response(STATUS, response_headers)
+    worker.send_headers(body, 1)
+    return worker.out_buffer[0]
+
+def run(label, build, iterations):
+    elapsed = timeit.timeit(lambda: [build(r) for r in RESPONSES],
+                            number=iterations)
+    per_response = elapsed / (iterations * len(RESPONSES)) * 1000000
+    print('%-8s %8.2f us per response' % (label, per_response))
+    return per_response
+
+def main(iterations=20000):
+    for response_headers in RESPONSES:
+        assert sorted(build_with_headers(response_headers).split(b('\r\n'))) == \
+               sorted(build_encoded(response_headers).split(b('\r\n')))
+
+    before = run('Headers', build_with_headers, iterations)
+    after = run('encoded', build_encoded, iterations)
+    print('%.1fx faster' % (before / after))
+
+if __name__ == '__main__':
+    main(*[int(x) for x in sys.argv[1:2]])
@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+
+# This file is part of the Rocket Web Server
+# Copyright (c) 2012 Timothy Farrell
+
+"""\
+Compare full and resumed TLS handshakes per second against a running Rocket
+HTTPS listener.  Each connection makes one HTTP/1.0 request so that the client
+receives the server's session ticket.  Run it from the source distribution::
+
+  python benchmarks/ssl_handshake.py [connections]
+"""
+
+# Import System Modules
+import os
+import sys
+import ssl
+import time
+import socket
+from wsgiref.simple_server import demo_app
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+# Import Custom Modules
+from rocket import Rocket, b
+
+# Constants
+ADDR = ('127.0.0.1', 47443)
+TESTS = os.path.join(os.path.dirname(__file__), '..', 'tests')
+KEY_FILE = os.path.join(TESTS, 'cert_key.pem')
+CERT_FILE = os.path.join(TESTS, 'cert.pem')
+REQUEST = b('GET / HTTP/1.0\r\n\r\n')
+
+def connect(context, session=None):
+    sock = socket.create_connection(ADDR)
+    sock = context.wrap_socket(sock, session=session)
+    sock.sendall(REQUEST)
+    while sock.recv(65536):
+        pass
+    session, reused = sock.session, sock.session_reused
+    sock.close()
+    return session, reused
+
+def run(label, context, count, resume):
+    session, reused = connect(context)
+    resumed = 0
+    start = time.time()
+    for x in range(count):
+        next_session, reused = connect(context, session if resume else None)
+        resumed += reused
+        if resume:
+            session = next_session
+    elapsed = time.time() - start
+    print('%-8s %8.1f handshakes/sec  (%i of %i resumed)'
+          % (label, count / elapsed, resumed, count))
+
+def main(count=500):
+    server = Rocket(ADDR + (KEY_FILE, CERT_FILE),
+                    'wsgi',
+                    {'wsgi_app': demo_app},
+                    handle_signals=False)
+    server.start(background=True)
+
+    try:
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)
+        context.check_hostname = False
+        context.verify_mode = ssl.CERT_NONE
+
+        run('full', context, count, resume=False)
+        run('resumed', context, count, resume=True)
+    finally:
+        server.stop()
+
+if __name__ == '__main__':
+    main(*[int(x) for x in sys.argv[1:2]])
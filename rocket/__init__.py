@@ -23,9 +23,13 @@ IGNORE_ERRORS_ON_CLOSE = set([errno.ECONNABORTED, errno.ECONNRESET])
 DEFAULT_LISTEN_QUEUE_SIZE = 5
 DEFAULT_MIN_THREADS = 10
 DEFAULT_MAX_THREADS = 0
+DEFAULT_MAX_HEADER_SIZE = 65536 # in bytes, for the request line and headers
+DEFAULT_MAX_HEADERS = 100
 DEFAULTS = dict(LISTEN_QUEUE_SIZE = DEFAULT_LISTEN_QUEUE_SIZE,
                 MIN_THREADS = DEFAULT_MIN_THREADS,
-                MAX_THREADS = DEFAULT_MAX_THREADS)
+                MAX_THREADS = DEFAULT_MAX_THREADS,
+                MAX_HEADER_SIZE = DEFAULT_MAX_HEADER_SIZE,
+                MAX_HEADERS = DEFAULT_MAX_HEADERS)
 
 PY3K = sys.version_info[0] > 2
 
@@ -4,23 +4,39 @@
 # Copyright (c) 2009 Timothy Farrell
 
 # Import System Modules
+import os
 import sys
 import time
 import socket
 try:
     import ssl
+    from ssl import SSLError
     has_ssl = True
 except ImportError:
     has_ssl = False
+    class SSLError(socket.error):
+        pass
 # Import Package Modules
 from . import IS_JYTHON, SOCKET_TIMEOUT, BUF_SIZE, b
-# TODO - This part is still very experimental.
-#from .filelike import FileLikeSocket
+from .poller import is_readable
+from .filelike import FileLikeSocket
+
+# The most buffers one sendmsg() call will take.  sysconf() gives -1 when
+# the limit is indeterminate; 16 is the least POSIX allows.
+try:
+    IOV_MAX = os.sysconf('SC_IOV_MAX')
+except (AttributeError, ValueError, OSError):
+    IOV_MAX = -1
+if IOV_MAX < 1:
+    IOV_MAX = 16
+IOV_MAX = min(IOV_MAX, 1024)
+has_sendmsg = hasattr(socket.socket, 'sendmsg')
 
 class Connection(object):
     __slots__ = [
         'setblocking',
         'sendall',
+        'writev',
         'shutdown',
         'makefile',
         'fileno',
@@ -29,8 +45,12 @@ class Connection(object):
         'server_port',
         'socket',
         'start_time',
+        'idle_timeout',
         'ssl',
         'secure',
+        'needs_handshake',
+        'environ',
+        'sock_file',
         'recv',
         'send',
         'read',
@@ -42,8 +62,14 @@ class Connection(object):
         self.server_port = port
         self.socket = sock_tuple[0]
         self.start_time = time.time()
+        # How long the Monitor may keep this connection parked.  None means
+        # use the server's timeout.
+        self.idle_timeout = None
         self.ssl = has_ssl and isinstance(self.socket, ssl.SSLSocket)
         self.secure = secure
+        # The Listener leaves the TLS handshake for the Worker to complete.
+        self.needs_handshake = self.ssl
+        self._build_environ()
 
         if IS_JYTHON:
             # In Jython we must set TCP_NODELAY here since it does not
@@ -53,18 +79,86 @@ class Connection(object):
 
         self.socket.settimeout(SOCKET_TIMEOUT)
 
+        self._bind_socket()
+
+    def _bind_socket(self):
         self.shutdown = self.socket.shutdown
         self.fileno = self.socket.fileno
         self.setblocking = self.socket.setblocking
         self.recv = self.socket.recv
         self.send = self.socket.send
         self.makefile = self.socket.makefile
+        self.sock_file = None
 
         if sys.platform == 'darwin':
             self.sendall = self._sendall_darwin
         else:
             self.sendall = self.socket.sendall
 
+        if has_sendmsg and not self.ssl and sys.platform != 'darwin':
+            self.writev = self._writev_sendmsg
+        else:
+            self.writev = self._writev_join
+
+    def _build_environ(self):
+        # The CGI variables that stay the same for every request made on this
+        # connection.  Workers copy them rather than rebuilding them.
+        self.environ = {'SERVER_PORT': str(self.server_port),
+                        'REMOTE_PORT': str(self.client_port),
+                        'REMOTE_ADDR': str(self.client_addr)}
+        if self.ssl:
+            self.environ['wsgi.url_scheme'] = 'https'
+            self.environ['HTTPS'] = 'on'
+        else:
+            self.environ['wsgi.url_scheme'] = 'http'
+
+    def handshake(self):
+        """Complete the TLS handshake.  This blocks for up to SOCKET_TIMEOUT
+        so it is done by a Worker rather than the Listener.  If the client did
+        not speak TLS, the connection falls back to plain text so that a 400
+        Bad Request can be sent."""
+        self.needs_handshake = False
+        try:
+            self.socket.do_handshake()
+        except SSLError:
+            # Generally this happens when an HTTP request is received on a
+            # secure socket.  The Worker will notice that self.ssl no longer
+            # matches self.secure and deal with it appropriately.
+            if not hasattr(self.socket, 'detach'):
+                raise
+            sock = self.socket
+            self.socket = socket.socket(sock.family,
+                                        sock.type,
+                                        sock.proto,
+                                        sock.detach())
+            self.socket.settimeout(SOCKET_TIMEOUT)
+            self.ssl = False
+            self._bind_socket()
+            self._build_environ()
+
+    def reader(self):
+        """Return the buffered file object that requests on this connection
+        are read from.  It lasts as long as the connection so that bytes read
+        past the end of one request, such as a pipelined request, are still
+        there for the next one."""
+        if self.sock_file is None:
+            self.sock_file = FileLikeSocket(self)
+        return self.sock_file
+
+    def has_pending(self):
+        """Return True if the client has already sent something that has not
+        been read.  Never blocks."""
+        if self.sock_file is not None and self.sock_file.pending():
+            # Requests the client pipelined may already be in our buffer,
+            # where poll() can't see them.
+            return True
+
+        if self.ssl and self.socket.pending():
+            # Decrypted data buffered by the ssl module is invisible to poll()
+            return True
+
+        return is_readable(self.socket)
+
     def _sendall_darwin(self, buf):
         pending = len(buf)
         offset = 0
@@ -80,11 +174,31 @@ class Connection(object):
                     raise
         return offset
 
-# FIXME - this is not ready for prime-time yet.
-#    def makefile(self, buf_size=BUF_SIZE):
-#        return FileLikeSocket(self, buf_size)
+    def _writev_sendmsg(self, buffers):
+        """Send every buffer in buffers, in order, with as few system calls
+        as possible.  Nothing is copied to join them."""
+        buffers = [x for x in buffers if len(x)]
+        i = 0
+        while i < len(buffers):
+            sent = self.socket.sendmsg(buffers[i:i + IOV_MAX])
+            # Skip what went out and keep the rest of a partly sent buffer
+            while sent:
+                size = len(buffers[i])
+                if sent < size:
+                    buffers[i] = memoryview(buffers[i])[sent:]
+                    break
+                sent -= size
+                i += 1
+
+    def _writev_join(self, buffers):
+        # SSL sockets can't sendmsg().  One sendall() still beats several.
+        self.sendall(b('').join(buffers))
 
     def close(self):
+        if self.sock_file is not None:
+            self.sock_file.close()
+            self.sock_file = None
+
         if hasattr(self.socket, '_sock'):
             try:
                 self.socket._sock.close()
@@ -4,121 +4,76 @@
 # Copyright (c) 2011 Timothy Farrell
 
 # Import System Modules
+import io
+import sys
+import errno
 import socket
 try:
-    from io import StringIO
+    import ssl
+    has_ssl = True
 except ImportError:
-    try:
-        from cStringIO import StringIO
-    except ImportError:
-        from StringIO import StringIO
+    has_ssl = False
 # Import Package Modules
-from . import BUF_SIZE, b
+from . import BUF_SIZE, SOCKET_TIMEOUT
+from .poller import WOULD_BLOCK, is_readable
 
-class FileLikeSocket(object):
-    def __init__(self, conn, buf_size=BUF_SIZE):
-        self.conn = conn
-        self.buf_size = buf_size
-        self.buffer = StringIO()
-        self.content_length = None
+class RawSocket(io.RawIOBase):
+    """The RawSocket class receives straight into the buffer it is given.
+    A non-blocking socket is waited on for up to SOCKET_TIMEOUT.  While wait
+    is False, it returns None rather than wait at all."""
+
+    def __init__(self, sock):
+        io.RawIOBase.__init__(self)
+        self.sock = sock
+        self.wait = True
+
+    def readable(self):
+        return True
 
-        if self.conn.socket.gettimeout() == 0.0:
-            self.read = self.non_blocking_read
-        else:
-            self.read = self.blocking_read
+    def fileno(self):
+        return self.sock.fileno()
 
-    def __iter__(self):
-        return self
+    def readinto(self, buf):
+        sock = self.sock
+        if not self.wait and not is_readable(sock) and \
+           not (has_ssl and isinstance(sock, ssl.SSLSocket) and sock.pending()):
+            return None
 
-    def recv(self, size):
         while True:
             try:
-                return self.conn.recv(size)
+                return sock.recv_into(buf)
             except socket.error:
-                exc = sys.exc_info()
-                e = exc[1]
-                # FIXME - Don't raise socket_errors_nonblocking or socket_error_eintr
-                if (e.args[0] not in set()):
-                    raise
-
-    def next(self):
-        data = self.readline()
-        if data == '':
-            raise StopIteration
-        return data
-
-    def non_blocking_read(self, size=None):
-        # Shamelessly adapted from Cherrypy!
-        bufr = self.buffer
-        bufr.seek(0, 2)
-        if size is None:
-            while True:
-                data = self.recv(self.buf_size)
-                if not data:
-                    break
-                bufr.write(data)
-
-            self.buffer = StringIO()
-
-            return bufr.getvalue()
-        else:
-            buf_len = self.buffer.tell()
-            if buf_len >= size:
-                bufr.seek(0)
-                data = bufr.read(size)
-                self.buffer = StringIO(bufr.read())
-                return data
-
-            self.buffer = StringIO()
-            while True:
-                remaining = size - buf_len
-                data = self.recv(remaining)
-
-                if not data:
-                    break
+                e = sys.exc_info()[1]
+                if e.args[0] == errno.EINTR:
+                    continue
+
+                if e.args[0] in WOULD_BLOCK or \
+                   (has_ssl and isinstance(e, ssl.SSLError) and
+                    e.args[0] == ssl.SSL_ERROR_WANT_READ):
+                    if not self.wait:
+                        return None
+                    if not is_readable(sock, SOCKET_TIMEOUT):
+                        raise socket.timeout('timed out')
+                    continue
+
+                raise
+
+class FileLikeSocket(io.BufferedReader):
+    """The FileLikeSocket class is the buffered reader requests are read
+    from.  Lines are found and copied out of one reusable buffer in C, and
+    reads larger than the buffer go straight from the socket into the
+    caller's buffer.  Unlike socket.makefile(), it can say whether anything
+    is buffered and it works with non-blocking sockets."""
 
-                n = len(data)
-                if n == size and not buf_len:
-                    return data
-
-                if n == remaining:
-                    bufr.write(data)
-                    del data
-                    break
-
-                bufr.write(data)
-                buf_len += n
-                del data
-
-            return bufr.getvalue()
-
-    def blocking_read(self, length=None):
-        if length is None:
-            if self.content_length is not None:
-                length = self.content_length
-            else:
-                length = 1
+    def __init__(self, conn, buf_size=BUF_SIZE):
+        io.BufferedReader.__init__(self, RawSocket(conn.socket), buf_size)
 
+    def pending(self):
+        """Return True if there is something to read right away, either in
+        our buffer or on the socket.  Never blocks."""
+        raw = self.raw
+        raw.wait = False
         try:
-            data = self.conn.recv(length)
-        except:
-            data = b('')
-
-        return data
-
-    def readline(self):
-        data = b("")
-        char = self.read(1)
-        while char != b('\n') and char is not b(''):
-            line = repr(char)
-            data += char
-            char = self.read(1)
-        data += char
-        return data
-
-    def readlines(self, hint="ignored"):
-        return list(self)
-
-    def close(self):
-        self.conn = None
-        self.content_length = None
+            return bool(self.peek(1))
+        finally:
+            raw.wait = True
@@ -5,10 +5,13 @@
 
 # Import System Modules
 import os
+import sys
+import errno
+import select
 import socket
 import logging
 import traceback
-from threading import Thread
+from threading import Lock, Thread
 
 try:
     import ssl
@@ -19,17 +22,32 @@ except ImportError:
     class SSLError(socket.error):
         pass
 # Import Package Modules
-from . import IS_JYTHON, NullHandler, THREAD_STOP_CHECK_INTERVAL
+from . import IS_JYTHON, NullHandler
+from .connection import Connection
+from .poller import DefaultSelector, EVENT_READ, Waker, WOULD_BLOCK, is_readable
+
+# Define Constants
+RETRY_ACCEPT = set([errno.EINTR, errno.ECONNABORTED])
 
 class Listener(Thread):
     """The Listener class is a class responsible for accepting connections
     and queuing them to be processed by a worker thread."""
 
-    def __init__(self, interface, queue_size, active_queue, *args, **kwargs):
+    def __init__(self,
+                 interface,
+                 queue_size,
+                 active_queue,
+                 ssl_options=None,
+                 monitor_queue=None,
+                 *args,
+                 **kwargs):
         Thread.__init__(self, *args, **kwargs)
 
         # Instance variables
         self.active_queue = active_queue
+        # When set, connections with nothing to read yet are parked here
+        # instead of tying up a Worker.
+        self.monitor_queue = monitor_queue
         self.interface = interface
         self.addr = interface[0]
         self.port = interface[1]
@@ -37,6 +55,8 @@ class Listener(Thread):
                       os.path.exists(interface[2]) and \
                       os.path.exists(interface[3])
         self.thread = None
+        self.waker = None
+        self.ssl_context = None
         self.ready = False
 
         # Error Log
@@ -68,6 +88,15 @@ class Listener(Thread):
                           "'%s'.  Cannot bind to %s:%s" % data)
                 return
 
+            if hasattr(ssl, 'SSLContext'):
+                try:
+                    self.ssl_context = self.build_ssl_context(ssl_options)
+                except (SSLError, ValueError, AttributeError):
+                    data = (interface[0], interface[1], traceback.format_exc())
+                    self.err_log.error("Cannot build SSL context.  Cannot "
+                                       "bind to %s:%s\n%s" % data)
+                    return
+
         # Set socket options
         try:
             listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
@@ -90,9 +119,9 @@ class Listener(Thread):
             msg = "Socket %s:%i in use by other process and it won't share."
             self.err_log.error(msg % (self.addr, self.port))
         else:
-            # We want socket operations to timeout periodically so we can
-            # check if the server is shutting down
-            listener.settimeout(THREAD_STOP_CHECK_INTERVAL)
+            # The accept loop waits in select() and drains the socket until
+            # it would block, so the socket itself must never block.
+            listener.setblocking(False)
             # Listen for new connections allowing queue_size number of
             # connections to wait before rejecting a connection.
             listener.listen(queue_size)
@@ -101,13 +130,64 @@ class Listener(Thread):
 
             self.ready = True
 
+    def build_ssl_context(self, options=None):
+        """Build the SSLContext shared by every connection on this listener.
+        The certificate chain is only loaded once and, because the session
+        cache and ticket keys live in the context, returning clients can
+        resume their TLS session instead of doing a full handshake."""
+        options = options or dict()
+
+        if hasattr(ssl, 'PROTOCOL_TLS_SERVER'):
+            context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        else:
+            context = ssl.SSLContext(ssl.PROTOCOL_SSLv23)
+            context.options |= ssl.OP_NO_SSLv2 | ssl.OP_NO_SSLv3
+
+        context.load_cert_chain(certfile = self.interface[3],
+                                keyfile = self.interface[2])
+
+        for name in ('minimum_version', 'maximum_version'):
+            version = options.get(name)
+            if isinstance(version, str):
+                version = getattr(ssl.TLSVersion, version)
+            if version is not None:
+                setattr(context, name, version)
+
+        if options.get('ciphers'):
+            context.set_ciphers(options['ciphers'])
+
+        if options.get('alpn_protocols'):
+            if getattr(ssl, 'HAS_ALPN', False):
+                context.set_alpn_protocols(options['alpn_protocols'])
+            else:
+                self.err_log.warning('This ssl module does not support ALPN.')
+
+        if options.get('session_tickets', True):
+            context.options &= ~getattr(ssl, 'OP_NO_TICKET', 0)
+            if 'num_tickets' in options and hasattr(context, 'num_tickets'):
+                context.num_tickets = options['num_tickets']
+        else:
+            context.options |= getattr(ssl, 'OP_NO_TICKET', 0)
+
+        return context
+
     def wrap_socket(self, sock):
+        # The handshake is deferred so that a slow or malicious client cannot
+        # stall the accept loop.  Connection.handshake() completes it in a
+        # Worker thread.
         try:
-            sock = ssl.wrap_socket(sock,
-                                   keyfile = self.interface[2],
-                                   certfile = self.interface[3],
-                                   server_side = True,
-                                   ssl_version = ssl.PROTOCOL_SSLv23)
+            if self.ssl_context is not None:
+                sock = self.ssl_context.wrap_socket(sock,
+                                                    server_side = True,
+                                                    do_handshake_on_connect = False)
+            else:
+                # Python < 2.7.9 has no SSLContext
+                sock = ssl.wrap_socket(sock,
+                                       keyfile = self.interface[2],
+                                       certfile = self.interface[3],
+                                       server_side = True,
+                                       ssl_version = ssl.PROTOCOL_SSLv23,
+                                       do_handshake_on_connect = False)
         except SSLError:
             # Generally this happens when an HTTP request is received on a
             # secure socket. We don't do anything because it will be detected
@@ -121,10 +201,13 @@ class Listener(Thread):
             self.err_log.warning('Listener started when not ready.')
             return
             
-        if self.thread is not None and self.thread.isAlive():
+        if self.thread is not None and self.thread.is_alive():
             self.err_log.warning('Listener already running.')
             return
-            
+
+        # Each run gets its own Waker so that forked processes sharing this
+        # listening socket don't share a self-pipe.
+        self.waker = Waker()
         self.thread = Thread(target=self.listen, name="Port" + str(self.port))
         
         self.thread.start()
@@ -133,43 +216,198 @@ class Listener(Thread):
         if self.thread is None:
             return False
         
-        return self.thread.isAlive()
+        return self.thread.is_alive()
 
-    def join(self):
+    def join(self, timeout=None):
         if self.thread is None:
             return
             
         self.ready = False
-        
-        self.thread.join()
-        
+        self.waker.wake()
+
+        self.thread.join(timeout)
+        if self.thread.is_alive():
+            return
+
         del self.thread
         self.thread = None
+        self.waker.close()
+        self.waker = None
         self.ready = True
     
-    def listen(self):
-        if __debug__:
-            self.err_log.debug('Entering main loop.')
+    def accept(self):
+        """Accept one connection from the listening socket.  Returns the
+        connection as it is queued for a Worker, or None if accept() would
+        block."""
         while True:
             try:
                 sock, addr = self.listener.accept()
+            except socket.error:
+                err = sys.exc_info()[1].args[0]
+                if err in WOULD_BLOCK:
+                    return None
+                if err in RETRY_ACCEPT:
+                    continue
+                raise
 
-                if self.secure:
-                    sock = self.wrap_socket(sock)
+            # Accepted sockets may inherit non-blocking mode from the
+            # listening socket on some platforms.
+            sock.setblocking(True)
 
-                self.active_queue.put(((sock, addr),
-                                       self.interface[1],
-                                       self.secure))
+            if self.secure:
+                sock = self.wrap_socket(sock)
 
-            except socket.timeout:
-                # socket.timeout will be raised every THREAD_STOP_CHECK_INTERVAL
-                # seconds.  When that happens, we check if it's time to die.
+            return ((sock, addr), self.interface[1], self.secure)
 
-                if not self.ready:
-                    if __debug__:
-                        self.err_log.debug('Listener exiting.')
-                    return
-                else:
-                    continue
-            except:
-                self.err_log.error(str(traceback.format_exc()))
+    def park(self, conn):
+        """Hand conn to the Monitor if the client hasn't sent anything yet
+        and this Listener defers connections.  Returns True if it did."""
+        if self.monitor_queue is None:
+            return False
+
+        sock = conn[0][0]
+        if not IS_JYTHON and is_readable(sock):
+            return False
+
+        # Let the Monitor hand it to a Worker once the client sends something.
+        self.monitor_queue.put(Connection(*conn))
+        return True
+
+    def accept_pending(self):
+        """Accept every connection waiting on the listening socket and queue
+        them.  Returns when accept() would block."""
+        while True:
+            conn = self.accept()
+            if conn is None:
+                return
+
+            if not self.park(conn):
+                self.active_queue.put(conn)
+
+    def listen(self):
+        if __debug__:
+            self.err_log.debug('Entering main loop.')
+
+        selector = DefaultSelector()
+        selector.register(self.listener, EVENT_READ)
+        selector.register(self.waker, EVENT_READ)
+
+        try:
+            while self.ready:
+                try:
+                    events = selector.select()
+                except (IOError, OSError, select.error):
+                    if sys.exc_info()[1].args[0] == errno.EINTR:
+                        continue
+                    raise
+
+                for key, mask in events:
+                    if key.fileobj is self.waker:
+                        # We've been woken up to check if it's time to die.
+                        self.waker.consume()
+                        continue
+
+                    try:
+                        self.accept_pending()
+                    except:
+                        self.err_log.error(str(traceback.format_exc()))
+        finally:
+            selector.close()
+
+        if __debug__:
+            self.err_log.debug('Listener exiting.')
+
+class Acceptor(object):
+    """The Acceptor class lets idle Worker threads accept connections
+    themselves instead of going through a Listener thread and the active
+    queue (the leader/follower pattern).  The Acceptor is itself queued on the
+    active queue.  The Worker that gets it becomes the leader and waits for a
+    connection on every listening socket.  It puts the Acceptor back, which
+    promotes the next idle Worker, before it serves the connection it
+    accepted."""
+
+    def __init__(self, listeners, active_queue):
+        self.listeners = listeners
+        self.active_queue = active_queue
+        self.active = False
+        self.selector = None
+        self.waker = None
+        # Only one Worker may lead at a time.  A stale Acceptor left on the
+        # active queue by an earlier run is dropped by whoever finds it.
+        self.lock = Lock()
+
+        # Error Log
+        self.err_log = logging.getLogger('Rocket.Errors.Acceptor')
+        self.err_log.addHandler(NullHandler())
+
+    def start(self):
+        self.waker = Waker()
+        self.selector = DefaultSelector()
+        self.selector.register(self.waker, EVENT_READ)
+        for l in self.listeners:
+            self.selector.register(l.listener, EVENT_READ, l)
+
+        self.active = True
+        self.active_queue.put(self)
+
+    def stop(self):
+        """Stop leading.  The Worker that is leading returns right away."""
+        self.active = False
+
+        waker = self.waker
+        if waker is not None:
+            waker.wake()
+
+    def close(self):
+        """Release the selector.  Only call this once no Worker can be
+        leading, i.e. after the ThreadPool has stopped."""
+        if self.selector is not None:
+            self.selector.close()
+            self.selector = None
+        if self.waker is not None:
+            self.waker.close()
+            self.waker = None
+
+    def lead(self):
+        """Wait for a connection on any listener and return it.  Returns None
+        if the Workers have something else to do first or if the Acceptor
+        was stopped."""
+        if not self.active or not self.lock.acquire(False):
+            return None
+
+        queue = self.active_queue
+
+        # Anything queued with no idle Worker to take it wakes us up.
+        queue.waker = self.waker
+        try:
+            while self.active and queue.qsize() <= queue.waiting:
+                try:
+                    events = self.selector.select()
+                except (IOError, OSError, select.error):
+                    if sys.exc_info()[1].args[0] == errno.EINTR:
+                        continue
+                    raise
+
+                for key, mask in events:
+                    if key.fileobj is self.waker:
+                        self.waker.consume()
+                        continue
+
+                    l = key.data
+                    try:
+                        conn = l.accept()
+                    except:
+                        l.err_log.error(str(traceback.format_exc()))
+                        continue
+
+                    if conn is not None and not l.park(conn):
+                        return conn
+
+            return None
+        finally:
+            queue.waker = None
+            self.lock.release()
+
+            # Promote the next leader
+            if self.active:
+                queue.put(self)
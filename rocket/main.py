@@ -4,23 +4,21 @@
 # Copyright (c) 2012 Timothy Farrell
 
 # Import System Modules
+import os
 import sys
 import time
+import errno
 import socket
 import logging
 import traceback
-from threading import Lock
-try:
-    from queue import Queue
-except ImportError:
-    from Queue import Queue
+from threading import Lock, Thread, current_thread
 
 # Import Package Modules
 from . import DEFAULTS, SERVER_SOFTWARE, NullHandler, THREAD_STOP_CHECK_INTERVAL
-from .monitor import Monitor
-from .threadpool import ThreadPool
+from .monitor import Monitor, MonitorQueue, ShardedMonitorQueue
+from .threadpool import ThreadPool, ActiveQueue, Router
 from .worker import get_method
-from .listener import Listener
+from .listener import Listener, Acceptor
 
 # Setup Logging
 log = logging.getLogger('Rocket')
@@ -39,12 +37,41 @@ class Rocket(object):
                  max_threads = None,
                  queue_size = None,
                  timeout = 600,
-                 handle_signals = True):
+                 handle_signals = True,
+                 processes = 1,
+                 ssl_options = None,
+                 defer_accept = False,
+                 monitors = 1,
+                 leader_follower = False,
+                 reserved_threads = 0,
+                 priority = None,
+                 pools = None,
+                 max_queued = 0,
+                 max_queue_age = None,
+                 overload_lifo = False,
+                 max_header_size = None,
+                 max_headers = None,
+                 max_chunk_size = None,
+                 max_body_size = None,
+                 spool_size = None,
+                 write_buffer_size = None):
 
         self.handle_signals = handle_signals
         self.startstop_lock = Lock()
+        self._stop_pending = False
         self.timeout = timeout
 
+        if processes > 1 and not hasattr(os, 'fork'):
+            log.warning('This platform cannot fork.  Running one process.')
+            processes = 1
+
+        self.processes = processes
+        self._child = False
+        self._supervisor = False
+        self._supervisor_thread = None
+        self._children = dict()
+        self._monitors = list()
+
         if not isinstance(interfaces, list):
             self.interfaces = [interfaces]
         else:
@@ -67,19 +94,72 @@ class Rocket(object):
 
         if isinstance(app_info, dict):
             app_info['server_software'] = SERVER_SOFTWARE
-
-        self.monitor_queue = Queue()
-        self.active_queue = Queue()
+            # Tells WSGI applications whether other processes run them too
+            app_info['processes'] = processes
+
+            if max_header_size is not None:
+                app_info['max_header_size'] = max_header_size
+            if max_headers is not None:
+                app_info['max_headers'] = max_headers
+            app_info['max_chunk_size'] = max_chunk_size
+            app_info['max_body_size'] = max_body_size
+            app_info['spool_size'] = spool_size
+            if write_buffer_size is not None:
+                app_info['write_buffer_size'] = write_buffer_size
+
+        if monitors > 1:
+            self.monitor_queue = ShardedMonitorQueue(monitors)
+        else:
+            self.monitor_queue = MonitorQueue()
+        # Admission control applies to every pool's active queue
+        queue_options = dict(maxsize = max_queued,
+                             max_age = max_queue_age,
+                             lifo = overload_lifo)
+        self.active_queue = ActiveQueue(**queue_options)
 
         self._threadpool = ThreadPool(get_method(method),
                                       app_info = app_info,
                                       active_queue = self.active_queue,
                                       monitor_queue = self.monitor_queue,
                                       min_threads = min_threads,
-                                      max_threads = max_threads)
+                                      max_threads = max_threads,
+                                      reserved_threads = reserved_threads,
+                                      priority = priority)
+        self._threadpools = [self._threadpool]
+
+        # Extra pools each get their own threads so that a slow part of the
+        # application cannot starve the rest.
+        if pools and isinstance(app_info, dict):
+            self._router = Router(self._threadpool)
+            app_info['router'] = self._router
+
+            for options in pools:
+                options = dict(options)
+                ports = [i[1] for i in options.pop('interfaces', ())]
+                prefixes = options.pop('prefixes', ())
+
+                pool = ThreadPool(get_method(method),
+                                  app_info = dict(app_info),
+                                  active_queue = ActiveQueue(**queue_options),
+                                  monitor_queue = self.monitor_queue,
+                                  **options)
+                self._router.add(pool, ports, prefixes)
+                self._threadpools.append(pool)
+        else:
+            self._router = None
 
         # Build our socket listeners
-        self.listeners = [Listener(i, queue_size, self.active_queue) for i in self.interfaces]
+        if defer_accept:
+            parking_queue = self.monitor_queue
+        else:
+            parking_queue = None
+
+        self.listeners = [Listener(i,
+                                   queue_size,
+                                   self._pool_for_port(i[1]).active_queue,
+                                   ssl_options,
+                                   parking_queue)
+                          for i in self.interfaces]
         for ndx in range(len(self.listeners)-1, 0, -1):
             if not self.listeners[ndx].ready:
                 del self.listeners[ndx]
@@ -88,15 +168,167 @@ class Rocket(object):
             log.critical("No interfaces to listen on...closing.")
             sys.exit(1)
 
+        # In leader/follower mode idle Workers take turns accepting
+        # connections and the Listeners never start their own threads.  Each
+        # pool's Workers accept on the Listeners bound to that pool.
+        self._acceptors = list()
+        if leader_follower:
+            for pool in self._threadpools:
+                listeners = [l for l in self.listeners
+                             if l.active_queue is pool.active_queue]
+                if listeners:
+                    self._acceptors.append(Acceptor(listeners,
+                                                    pool.active_queue))
+
+    def _pool_for_port(self, port):
+        if self._router is None:
+            return self._threadpool
+        return self._router.pool_for_port(port)
+
     def _sigterm(self, signum, frame):
         log.info('Received SIGTERM')
-        self.stop()
+        if self.startstop_lock.acquire(False):
+            self.startstop_lock.release()
+            self.stop()
+        else:
+            # The signal interrupted start() or stop().  Calling stop() here
+            # would deadlock on startstop_lock, so let start()'s main loop
+            # take care of it.
+            self._stop_pending = True
 
     def _sighup(self, signum, frame):
         log.info('Received SIGHUP')
-        self.restart()
+        if self._supervisor:
+            self._signal_children(signum)
+        else:
+            self.restart()
+
+    def _signal_children(self, signum):
+        for pid in list(self._children.keys()):
+            try:
+                os.kill(pid, signum)
+            except OSError:
+                # The child already exited.  _supervise() will reap it.
+                pass
+
+    def _fork_child(self):
+        pid = os.fork()
+        if pid:
+            self._children[pid] = time.time()
+            return
+
+        # This is the child process.  It serves connections on the listening
+        # sockets inherited from the supervisor until it receives SIGTERM.
+        status = 0
+        try:
+            self._child = True
+            self.startstop_lock = Lock()
+            self._supervisor = False
+            self._supervisor_thread = None
+            self._children = dict()
+
+            # The supervisor controls its children with signals whether or not
+            # it handles signals itself.  Ctrl-C is the supervisor's business.
+            import signal
+            signal.signal(signal.SIGTERM, self._sigterm)
+            signal.signal(signal.SIGUSR1, self._sighup)
+            signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+            self.start()
+        except:
+            log.critical(str(traceback.format_exc()))
+            status = 1
+
+        os._exit(status)
+
+    def _supervise(self):
+        if __debug__:
+            log.debug('Entering supervisor loop.')
+
+        while self._supervisor or self._children:
+            while self._supervisor and len(self._children) < self.processes:
+                self._fork_child()
+
+            try:
+                pid, status = os.waitpid(-1, 0)
+            except OSError:
+                err = sys.exc_info()[1].args[0]
+                if err == errno.EINTR:
+                    continue
+                if err == errno.ECHILD:
+                    self._children.clear()
+                    continue
+                raise
+
+            started = self._children.pop(pid, None)
+            if started is None or not self._supervisor:
+                continue
+
+            log.warning('Worker process %i exited with status %i.  '
+                        'Restarting it.' % (pid, status))
+
+            # Don't fork-bomb the machine if children die on startup.
+            if time.time() - started < THREAD_STOP_CHECK_INTERVAL:
+                time.sleep(THREAD_STOP_CHECK_INTERVAL)
+
+        if __debug__:
+            log.debug('Supervisor exiting.')
+
+    def _start_supervisor(self, background):
+        log.info('Starting %s with %i processes' % (SERVER_SOFTWARE,
+                                                    self.processes))
+
+        self.startstop_lock.acquire()
+
+        try:
+            if self.handle_signals:
+                try:
+                    import signal
+                    signal.signal(signal.SIGTERM, self._sigterm)
+                    signal.signal(signal.SIGUSR1, self._sighup)
+                except:
+                    log.debug('This platform does not support signals.')
+
+            self._supervisor = True
+
+            if background:
+                self._supervisor_thread = Thread(target=self._supervise,
+                                                 name='Supervisor')
+                self._supervisor_thread.daemon = True
+                self._supervisor_thread.start()
+        finally:
+            self.startstop_lock.release()
+
+        if background:
+            return
+
+        try:
+            self._supervise()
+        except KeyboardInterrupt:
+            # Capture a keyboard interrupt when running from a console
+            self.stop()
+            self._supervise()
+
+    def _stop_supervisor(self):
+        self.startstop_lock.acquire()
+
+        try:
+            self._supervisor = False
+
+            import signal
+            self._signal_children(signal.SIGTERM)
+        finally:
+            self.startstop_lock.release()
+
+        thread = self._supervisor_thread
+        if thread is not None and thread is not current_thread():
+            thread.join()
+            self._supervisor_thread = None
 
     def start(self, background=False):
+        if self.processes > 1 and not self._child:
+            return self._start_supervisor(background)
+
         log.info('Starting %s' % SERVER_SOFTWARE)
 
         self.startstop_lock.acquire()
@@ -112,15 +344,30 @@ class Rocket(object):
                     log.debug('This platform does not support signals.')
 
             # Start our worker threads
-            self._threadpool.start()
+            for pool in self._threadpools:
+                pool.start()
+                pool.start_resizer()
 
-            # Start our monitor thread
-            self._monitor = Monitor(self.monitor_queue,
-                                    self.active_queue,
-                                    self.timeout,
-                                    self._threadpool)
-            self._monitor.setDaemon(True)
-            self._monitor.start()
+            # Start our monitor threads, one per shard of the monitor queue
+            if isinstance(self.monitor_queue, ShardedMonitorQueue):
+                queues = self.monitor_queue.shards
+            else:
+                queues = [self.monitor_queue]
+
+            # With several pools, readable connections go back to the pool
+            # that serves their port.
+            active_queue = self._router or self.active_queue
+
+            self._monitors = list()
+            for i in range(len(queues)):
+                monitor = Monitor(queues[i],
+                                  active_queue,
+                                  self.timeout,
+                                  None,
+                                  name='Monitor%i' % i)
+                monitor.daemon = True
+                monitor.start()
+                self._monitors.append(monitor)
 
             # I know that EXPR and A or B is bad but I'm keeping it for Py2.4
             # compatibility.
@@ -130,8 +377,12 @@ class Rocket(object):
             msg += ', '.join(['%s:%i%s' % str_extract(l) for l in self.listeners])
             log.info(msg)
 
-            for l in self.listeners:
-                l.start()
+            if self._acceptors:
+                for a in self._acceptors:
+                    a.start()
+            else:
+                for l in self.listeners:
+                    l.start()
 
         finally:
             self.startstop_lock.release()
@@ -139,43 +390,61 @@ class Rocket(object):
         if background:
             return
 
-        while self._monitor.isAlive():
+        while self._monitoring() and not self._stop_pending:
             try:
                 time.sleep(THREAD_STOP_CHECK_INTERVAL)
             except KeyboardInterrupt:
                 # Capture a keyboard interrupt when running from a console
                 break
             except:
-                if self._monitor.isAlive():
+                if self._monitoring():
                     log.error(str(traceback.format_exc()))
                     continue
 
         return self.stop()
 
+    def _monitoring(self):
+        for m in self._monitors:
+            if not m.is_alive():
+                return False
+        return True
+
     def stop(self, stoplogging = False):
         log.info('Stopping %s' % SERVER_SOFTWARE)
 
+        if self._supervisor:
+            return self._stop_supervisor()
+
         self.startstop_lock.acquire()
         
         try:
-            # Stop listeners
+            # Stop listeners.  Joining wakes them up so they exit immediately.
             for l in self.listeners:
                 l.ready = False
 
-            # Encourage a context switch
-            time.sleep(0.01)
-
             for l in self.listeners:
                 if l.isAlive():
                     l.join()
 
-            # Stop Monitor
-            self._monitor.stop()
-            if self._monitor.isAlive():
-                self._monitor.join()
+            for a in self._acceptors:
+                a.stop()
+
+            # Stop Monitors
+            for m in self._monitors:
+                m.stop()
+
+            for m in self._monitors:
+                if m.is_alive():
+                    m.join()
 
             # Stop Worker threads
-            self._threadpool.stop()
+            for pool in self._threadpools:
+                pool.stop()
+
+            for a in self._acceptors:
+                a.close()
+
+            self._stop_pending = False
 
             if stoplogging:
                 logging.shutdown()
@@ -191,6 +460,11 @@ class Rocket(object):
         finally:
             self.startstop_lock.release()
 
+    def stats(self):
+        """Return a list with a dictionary of statistics for each ThreadPool,
+        starting with the main one.  See ThreadPool.stats()."""
+        return [pool.stats() for pool in self._threadpools]
+
     def restart(self):
         self.stop()
         self.start()
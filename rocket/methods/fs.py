@@ -7,16 +7,14 @@
 import os
 import time
 import mimetypes
-from email.utils import formatdate
-from wsgiref.headers import Headers
 from wsgiref.util import FileWrapper
 # Import Package Modules
-from .. import HTTP_SERVER_SOFTWARE, b, BUF_SIZE
-from ..worker import Worker
+from .. import b
+from ..worker import Worker, SERVER_HEADER, status_line, date_header
+from ..worker import encode_headers
 
 # Define Constants
 CHUNK_SIZE = 2**16 # 64 Kilobyte chunks
-HEADER_RESPONSE = '''HTTP/1.1 %s\r\n%s'''
 INDEX_HEADER = '''\
 <html>
 <head><title>Directory Index: %(path)s</title>
@@ -55,7 +53,7 @@ class FileSystemWorker(Worker):
         self.size = filestat.st_size
         modtime = time.strftime("%a, %d %b %Y %H:%M:%S GMT",
                                 time.gmtime(filestat.st_mtime))
-        self.headers.add_header('Last-Modified', modtime)
+        self.headers.append(('Last-Modified', modtime))
         if headers.get('if_modified_since') == modtime:
             # The browser cache is up-to-date, send a 304.
             self.status = "304 Not Modified"
@@ -66,13 +64,13 @@ class FileSystemWorker(Worker):
         self.content_type = ct if ct else 'text/plain'
         try:
             f = open(filepath, 'rb')
-            self.headers['Pragma'] = 'cache'
-            self.headers['Cache-Control'] = 'private'
-            self.headers['Content-Length'] = str(self.size)
+            self.headers.append(('Pragma', 'cache'))
+            self.headers.append(('Cache-Control', 'private'))
+            self.headers.append(('Content-Length', str(self.size)))
             if self.etag:
-                self.headers.add_header('Etag', self.etag)
+                self.headers.append(('Etag', self.etag))
             if self.expires:
-                self.headers.add_header('Expires', self.expires)
+                self.headers.append(('Expires', self.expires))
 
             try:
                 # Implement 206 partial file support.
@@ -114,7 +112,8 @@ class FileSystemWorker(Worker):
             self.data += ['<tr><th>Files</th></tr>']
             self.data += [INDEX_ROW % dict(name=os.path.basename(x), link=os.path.join(rpth, os.path.basename(x)).replace('\\', '/'), cls='file') for x in files]
             self.data += [INDEX_FOOTER]
-            self.headers['Content-Length'] = self.size = str(sum([len(x) for x in self.data]))
+            self.size = str(sum([len(x) for x in self.data]))
+            self.headers.append(('Content-Length', self.size))
             self.status = '200 OK'
 
     def run_app(self, conn):
@@ -124,12 +123,10 @@ class FileSystemWorker(Worker):
         self.etag = None
         self.content_type = 'text/plain'
         self.content_length = None
+        self.data = []
 
-        if __debug__:
-            self.err_log.debug('Getting sock_file')
-            
-        # Build our file-like object
-        sock_file = conn.makefile('rb',BUF_SIZE)
+        # The connection keeps its file-like object between requests.
+        sock_file = conn.reader()
         request = self.read_request_line(sock_file)
         if request['method'].upper() not in ('GET', ):
             self.status = "501 Not Implemented"
@@ -144,10 +141,7 @@ class FileSystemWorker(Worker):
                 self.err_log.debug('Request for path: %s' % filepath)
                 
             self.closeConnection = headers.get('connection', 'close').lower() == 'close'
-            self.headers = Headers([('Date', formatdate(usegmt=True)),
-                                    ('Server', HTTP_SERVER_SOFTWARE),
-                                    ('Connection', headers.get('connection', 'close')),
-                                   ])
+            self.headers = [('Connection', headers.get('connection', 'close'))]
 
             if not filepath.lower().startswith(self.root.lower()):
                 # File must be within our root directory
@@ -170,24 +164,25 @@ class FileSystemWorker(Worker):
             statcode, statstr = self.status.split(' ', 1)
             statcode = int(statcode)
             if statcode >= 400:
-                h.add_header('Content-Type', self.content_type)
+                h.append(('Content-Type', self.content_type))
                 self.data = [statstr]
 
             # Build our output headers
-            header_data = HEADER_RESPONSE % (self.status, str(h))
+            header_data = b('').join([status_line(self.status),
+                                      date_header(),
+                                      SERVER_HEADER,
+                                      encode_headers(h)[0],
+                                      b('\r\n')])
 
-            # Send the headers
+            # Send the headers along with the first piece of the body
             if __debug__:
                 self.err_log.debug('Sending Headers: %s' % repr(header_data))
-            self.conn.sendall(b(header_data))
+            data = iter(self.data)
+            self.conn.writev([header_data, b(next(data, ''))])
 
-            for data in self.data:
-                self.conn.sendall(b(data))
+            for d in data:
+                self.conn.sendall(b(d))
 
+        finally:
             if hasattr(self.data, 'close'):
                 self.data.close()
-
-        finally:
-            if __debug__:
-                self.err_log.debug('Finally closing sock_file')
-            sock_file.close()
@@ -6,32 +6,66 @@
 # Import System Modules
 import sys
 import socket
-from wsgiref.headers import Headers
 from wsgiref.util import FileWrapper
+from tempfile import SpooledTemporaryFile
 
 # Import Package Modules
-from .. import HTTP_SERVER_SOFTWARE, SERVER_NAME, b, BUF_SIZE, PY3K
-from ..worker import Worker, ChunkedReader
+from .. import SERVER_NAME, b, PY3K, BUF_SIZE
+from ..worker import Worker, ChunkedReader, LengthReader, BadRequest
+from ..worker import COMMON_HEADERS, HEADER_NAME_CACHE_SIZE, header_name
+from ..worker import SERVER_HEADER, status_line, date_header, encode_headers
 from ..futures import has_futures
 
-if PY3K:
-    from email.utils import formatdate
-else:
-    # Caps Utils for Py2.4 compatibility
-    from email.Utils import formatdate
-
 # Define Constants
 NEWLINE = b('\r\n')
-HEADER_RESPONSE = '''HTTP/1.1 %s\r\n%s'''
+CHUNKED_HEADER = b('Transfer-Encoding: Chunked\r\n')
+# Chunked request bodies are kept in memory up to this size unless
+# spool_size is set
+SPOOL_SIZE = 1048576
+# Up to this much of a body the application didn't read is thrown away to
+# keep the connection open.  Beyond it, the connection is closed.
+MAX_DRAIN_SIZE = 65536
+# Response output is held until this much is ready, or until WSGI requires
+# that it be sent, and then goes out in one system call (and as one chunk)
+# unless write_buffer_size is set
+WRITE_BUFFER_SIZE = BUF_SIZE
+LAST_CHUNK = b('0\r\n\r\n')
 BASE_ENV = {'SERVER_NAME': SERVER_NAME,
             'SCRIPT_NAME': '',  # Direct call WSGI does not need a name
             'wsgi.errors': sys.stderr,
             'wsgi.version': (1, 0),
-            'wsgi.multiprocess': False,
             'wsgi.run_once': False,
             'wsgi.file_wrapper': FileWrapper
             }
 
+try:
+    intern = sys.intern
+except AttributeError:
+    # Python 2 has it as a builtin
+    pass
+
+_environ_keys = dict()
+
+def environ_key(name):
+    """Return the environ key for a header with the CGI name name (e.g.
+    "HTTP_HOST" for "HOST").  Keys are interned and cached so that the
+    common ones aren't rebuilt for every request."""
+    try:
+        return _environ_keys[name]
+    except KeyError:
+        pass
+
+    key = intern(str('HTTP_' + name))
+
+    if len(_environ_keys) < HEADER_NAME_CACHE_SIZE:
+        _environ_keys[name] = key
+
+    return key
+
+for name in COMMON_HEADERS:
+    environ_key(header_name(name))
+del name
+
 class WSGIWorker(Worker):
     def __init__(self, *args, **kwargs):
         """Builds some instance variables that will last the life of the
@@ -40,13 +74,29 @@ class WSGIWorker(Worker):
 
         if isinstance(self.app_info, dict):
             multithreaded = self.app_info.get('max_threads') != 1
+            multiprocess = self.app_info.get('processes', 1) > 1
         else:
             multithreaded = False
+            multiprocess = False
         self.base_environ = dict({'SERVER_SOFTWARE': self.app_info['server_software'],
                                   'wsgi.multithread': multithreaded,
+                                  'wsgi.multiprocess': multiprocess,
                                   })
         self.base_environ.update(BASE_ENV)
 
+        # The application's response headers, encoded by start_response()
+        self.header_set = dict()
+        self.header_data = None
+
+        # Output waiting to be sent by flush()
+        self.out_buffer = []
+        self.out_size = 0
+        self.chunk_start = 0
+        self.chunk_size = 0
+        self.write_buffer_size = self.app_info.get('write_buffer_size')
+        if self.write_buffer_size is None:
+            self.write_buffer_size = WRITE_BUFFER_SIZE
+
         # Grab our application
         self.app = self.app_info.get('wsgi_app')
 
@@ -64,20 +114,19 @@ class WSGIWorker(Worker):
         # Grab the request line
         request = self.read_request_line(sock_file)
 
-        # Copy the Base Environment
+        # Copy the Base Environment and the variables that are the same for
+        # every request on this connection
         environ = self.base_environ.copy()
+        environ.update(conn.environ)
 
         # Grab the headers
         for k, v in self.read_headers(sock_file).items():
-            environ[str('HTTP_'+k)] = v
+            environ[environ_key(k)] = v
 
         # Add CGI Variables
         environ['REQUEST_METHOD'] = request['method']
         environ['PATH_INFO'] = request['path']
         environ['SERVER_PROTOCOL'] = request['protocol']
-        environ['SERVER_PORT'] = str(conn.server_port)
-        environ['REMOTE_PORT'] = str(conn.client_port)
-        environ['REMOTE_ADDR'] = str(conn.client_addr)
         environ['QUERY_STRING'] = request['query_string']
         if 'HTTP_CONTENT_LENGTH' in environ:
             environ['CONTENT_LENGTH'] = environ['HTTP_CONTENT_LENGTH']
@@ -87,33 +136,82 @@ class WSGIWorker(Worker):
         # Save the request method for later
         self.request_method = environ['REQUEST_METHOD']
 
-        # Add Dynamic WSGI Variables
-        if conn.ssl:
-            environ['wsgi.url_scheme'] = 'https'
-            environ['HTTPS'] = 'on'
+        # Find the request body
+        chunked = 'chunked' in environ.get('HTTP_TRANSFER_ENCODING', '').lower()
+        if chunked:
+            length = None
         else:
-            environ['wsgi.url_scheme'] = 'http'
-
-        if environ.get('HTTP_TRANSFER_ENCODING', '') == 'chunked':
-            environ['wsgi.input'] = ChunkedReader(sock_file)
+            length = environ.get('CONTENT_LENGTH', '0') or '0'
+            # isdigit() would pass digits such as '\xb2' that int() refuses
+            if length.strip('0123456789'):
+                self.send_response('400 Bad Request')
+                raise BadRequest
+
+            length = int(length)
+            if self.max_body_size is not None and length > self.max_body_size:
+                self.send_response('413 Request Entity Too Large')
+                raise BadRequest
+
+        # Handle 100 Continue
+        if environ.get('HTTP_EXPECT', '').lower() == '100-continue':
+            res = environ['SERVER_PROTOCOL'] + ' 100 Continue\r\n\r\n'
+            conn.sendall(b(res))
+
+        if chunked:
+            # Applications get the body de-chunked, with its real length.
+            try:
+                body = self.spool(ChunkedReader(sock_file,
+                                                self.max_chunk_size,
+                                                self.max_body_size,
+                                                self.max_header_size),
+                                  SPOOL_SIZE if self.spool_size is None
+                                             else self.spool_size)
+            except BadRequest:
+                # Tell the client why before the connection is closed
+                self.send_response(sys.exc_info()[1].status)
+                raise
+            environ['CONTENT_LENGTH'] = str(body.tell())
+            body.seek(0)
+            del environ['HTTP_TRANSFER_ENCODING']
         else:
-            environ['wsgi.input'] = sock_file
+            body = LengthReader(sock_file, length)
+            if self.spool_size is not None and length > self.spool_size:
+                # Don't tie the application up while a big body trickles in.
+                body = self.spool(body, self.spool_size)
+                body.seek(0)
+
+        environ['wsgi.input'] = body
 
         return environ
 
+    def spool(self, body, max_size):
+        """Read all of body into a file that stays in memory up to max_size
+        bytes and moves to disk after that."""
+        spool = SpooledTemporaryFile(max_size=max_size)
+        try:
+            data = body.read(BUF_SIZE)
+            while data:
+                spool.write(data)
+                data = body.read(BUF_SIZE)
+        except:
+            spool.close()
+            raise
+        return spool
+
     def send_headers(self, data, sections):
         h_set = self.header_set
+        out = [status_line(self.status), self.header_data]
 
         # Does the app want us to send output chunked?
         self.chunked = h_set.get('transfer-encoding', '').lower() == 'chunked'
 
         # Add a Date header if it's not there already
         if not 'date' in h_set:
-            h_set['Date'] = formatdate(usegmt=True)
+            out.append(date_header())
 
         # Add a Server header if it's not there already
         if not 'server' in h_set:
-            h_set['Server'] = HTTP_SERVER_SOFTWARE
+            out.append(SERVER_HEADER)
 
         if 'content-length' in h_set:
             self.size = int(h_set['content-length'])
@@ -123,38 +221,42 @@ class WSGIWorker(Worker):
                 if sections == 1 or self.protocol != 'HTTP/1.1':
                     # Add a Content-Length header because it's not there already
                     self.size = len(data)
-                    h_set['Content-Length'] = str(self.size)
+                    out.append(b('Content-Length: %i\r\n' % self.size))
                 else:
                     # If they sent us more than one section, we blow chunks
-                    h_set['Transfer-Encoding'] = 'Chunked'
+                    out.append(CHUNKED_HEADER)
                     self.chunked = True
                     if __debug__:
                         self.err_log.debug('Adding header...'
                                            'Transfer-Encoding: Chunked')
 
-        if 'connection' not in h_set:
+        connection = h_set.get('connection')
+        if connection is None:
             # If the application did not provide a connection header, fill it in
             client_conn = self.environ.get('HTTP_CONNECTION', '').lower()
             if self.environ['SERVER_PROTOCOL'] == 'HTTP/1.1':
                 # HTTP = 1.1 defaults to keep-alive connections
                 if client_conn:
-                    h_set['Connection'] = client_conn
+                    connection = client_conn
                 else:
-                    h_set['Connection'] = 'keep-alive'
+                    connection = 'keep-alive'
             else:
                 # HTTP < 1.1 supports keep-alive but it's quirky so we don't support it
-                h_set['Connection'] = 'close'
+                connection = 'close'
+            out.append(b('Connection: %s\r\n' % connection))
 
         # Close our connection if we need to.
-        self.closeConnection = h_set.get('connection', '') == 'close'
+        self.closeConnection = connection == 'close'
 
         # Build our output headers
-        header_data = HEADER_RESPONSE % (self.status, str(h_set))
+        out.append(NEWLINE)
+        header_data = b('').join(out)
 
-        # Send the headers
+        # Queue the headers to go out with the start of the body
         if __debug__:
             self.err_log.debug('Sending Headers: %s' % repr(header_data))
-        self.conn.sendall(b(header_data))
+        self.out_buffer.append(header_data)
+        self.out_size += len(header_data)
         self.headers_sent = True
 
     def write_warning(self, data, sections=None):
@@ -172,12 +274,38 @@ class WSGIWorker(Worker):
         if not self.headers_sent:
             self.send_headers(data, sections)
 
-        if self.request_method != 'HEAD':
+        if self.request_method != 'HEAD' and data:
+            if self.chunked:
+                if not self.chunk_size:
+                    # Keep a place for the size of the chunk this starts
+                    self.chunk_start = len(self.out_buffer)
+                    self.out_buffer.append(None)
+                self.chunk_size += len(data)
+            self.out_buffer.append(data)
+            self.out_size += len(data)
+
+        # The pieces of a list are all ready to go.  Anything else might take
+        # its time making the next piece, so WSGI says this one can't wait.
+        if sections is None or self.out_size >= self.write_buffer_size:
+            self.flush()
+
+    def end_chunk(self):
+        """Frame the body pieces buffered since the last chunk as one chunk.
+        The pieces themselves are sent as they are, not copied into it."""
+        if self.chunk_size:
+            self.out_buffer[self.chunk_start] = b('%x\r\n' % self.chunk_size)
+            self.out_buffer.append(NEWLINE)
+            self.chunk_size = 0
+
+    def flush(self):
+        """Send everything write() has buffered."""
+        self.end_chunk()
+        out = self.out_buffer
+        if out:
+            self.out_buffer = []
+            self.out_size = 0
             try:
-                if self.chunked:
-                    self.conn.sendall(b('%x\r\n%s\r\n' % (len(data), data)))
-                else:
-                    self.conn.sendall(data)
+                self.conn.writev(out)
             except socket.timeout:
                 self.closeConnection = True
             except socket.error:
@@ -196,7 +324,7 @@ class WSGIWorker(Worker):
                     raise
             finally:
                 exc_info = None
-        elif self.header_set:
+        elif self.header_data is not None:
             raise AssertionError("Headers already set!")
 
         if PY3K and not isinstance(status, str):
@@ -205,8 +333,9 @@ class WSGIWorker(Worker):
             self.status = status
         # Make sure headers are bytes objects
         try:
-            self.header_set = Headers(response_headers)
-        except UnicodeDecodeError:
+            self.header_data, self.header_set = encode_headers(response_headers)
+        except UnicodeError:
+            self.header_data, self.header_set = b(''), dict()
             self.error = ('500 Internal Server Error',
                           'HTTP Headers should be bytes')
             self.err_log.error('Received HTTP Headers from client that contain'
@@ -216,30 +345,39 @@ class WSGIWorker(Worker):
 
     def run_app(self, conn):
         self.size = 0
-        self.header_set = Headers([])
+        self.header_set = dict()
+        self.header_data = None
         self.headers_sent = False
         self.error = (None, None)
         self.chunked = False
+        self.out_buffer = []
+        self.out_size = 0
+        self.chunk_size = 0
         sections = None
         output = None
+        body = None
 
-        if __debug__:
-            self.err_log.debug('Getting sock_file')
-
-        # Build our file-like object
-        if PY3K:
-            sock_file = conn.makefile(mode='rb', buffering=BUF_SIZE)
+        handoff = self.handoff
+        if handoff is not None:
+            # Another Worker read the request and handed it to us.
+            sock_file = handoff.sock_file
         else:
-            sock_file = conn.makefile(BUF_SIZE)
+            # The connection keeps its file-like object between requests.
+            sock_file = conn.reader()
 
         try:
-            # Read the headers and build our WSGI environment
-            self.environ = environ = self.build_environ(sock_file, conn)
+            if handoff is not None:
+                self.environ = environ = handoff.environ
+                self.request_method = environ['REQUEST_METHOD']
+            else:
+                # Read the headers and build our WSGI environment
+                self.environ = environ = self.build_environ(sock_file, conn)
+
+                # Another ThreadPool may be responsible for this path.
+                if self.hand_off(environ['PATH_INFO'], sock_file, environ):
+                    return
 
-            # Handle 100 Continue
-            if environ.get('HTTP_EXPECT', '') == '100-continue':
-                res = environ['SERVER_PROTOCOL'] + ' 100 Continue\r\n\r\n'
-                conn.sendall(b(res))
+            body = environ['wsgi.input']
 
             # Send it to our WSGI application
             output = self.app(environ, self.start_response)
@@ -263,15 +401,25 @@ class WSGIWorker(Worker):
 
             if self.chunked and self.request_method != 'HEAD':
                 # If chunked, send our final chunk length
-                self.conn.sendall(b('0\r\n\r\n'))
+                self.end_chunk()
+                self.out_buffer.append(LAST_CHUNK)
+
+            self.flush()
+
+            # Whatever the application left of the body must not be taken
+            # for the next request.
+            if not self.closeConnection and isinstance(body, LengthReader) \
+               and not body.drain(MAX_DRAIN_SIZE):
+                self.closeConnection = True
 
         # Don't capture exceptions here.  The Worker class handles
         # them appropriately.
         finally:
             if __debug__:
-                self.err_log.debug('Finally closing output and sock_file')
+                self.err_log.debug('Finally closing output')
 
             if hasattr(output,'close'):
                 output.close()
 
-            sock_file.close()
+            if isinstance(body, SpooledTemporaryFile) and not self.handed_off:
+                body.close()
@@ -5,12 +5,52 @@
 
 # Import System Modules
 import time
+import heapq
 import logging
-import select
 from threading import Thread
+try:
+    from queue import Queue
+except ImportError:
+    from Queue import Queue
 
 # Import Package Modules
 from . import IS_JYTHON, THREAD_STOP_CHECK_INTERVAL, NullHandler
+from .poller import DefaultSelector, EVENT_READ, Waker
+
+class MonitorQueue(Queue):
+    """The MonitorQueue class is a Queue that wakes the Monitor up whenever
+    something is put on it, so that a parked connection is watched right away
+    rather than on the Monitor's next pass."""
+
+    waker = None
+
+    def _put(self, item):
+        Queue._put(self, item)
+
+        waker = self.waker
+        if waker is not None:
+            waker.wake()
+
+class ShardedMonitorQueue(object):
+    """The ShardedMonitorQueue class spreads connections over several
+    MonitorQueues by file descriptor so that each can be watched by its own
+    Monitor thread."""
+
+    def __init__(self, shards):
+        self.shards = [MonitorQueue() for x in range(shards)]
+
+    def put(self, item, block=True, timeout=None):
+        shard = self.shards[item.fileno() % len(self.shards)]
+        shard.put(item, block, timeout)
+
+    def qsize(self):
+        return sum([q.qsize() for q in self.shards])
+
+    def empty(self):
+        for q in self.shards:
+            if not q.empty():
+                return False
+        return True
 
 class Monitor(Thread):
     # Monitor worker class.
@@ -35,120 +75,192 @@ class Monitor(Thread):
         self.log = logging.getLogger('Rocket.Monitor')
         self.log.addHandler(NullHandler())
 
-        self.connections = set()
+        # Maps each parked connection to its entry in the deadlines heap.
+        # Entries for connections that have since left the monitor are
+        # skipped when they reach the top of the heap.
+        self.connections = dict()
+        self.deadlines = list()
+        self._sequence = 0
         self.active = False
+        self.waker = None
 
     def run(self):
         self.active = True
-        conn_list = list()
-        list_changed = False
 
-        # We need to make sure the queue is empty before we start
+        # Each run gets its own Waker so that forked processes don't share
+        # one.  Connections put on a MonitorQueue or a call to stop() will
+        # interrupt select().
+        self.waker = Waker()
+        if isinstance(self.monitor_queue, MonitorQueue):
+            self.monitor_queue.waker = self.waker
+
+        # We need to make sure the death threat left by a previous stop() is
+        # gone before we start, but keep any connections already parked.
+        parked = list()
         while not self.monitor_queue.empty():
-            self.monitor_queue.get()
+            c = self.monitor_queue.get()
+            if c is not None:
+                parked.append(c)
+
+        for c in parked:
+            self.monitor_queue.put(c)
+
+        # Parked connections stay registered with the selector (epoll,
+        # kqueue, etc. where available) until they become readable or go
+        # stale, so each pass only costs as much as the events it returns.
+        selector = DefaultSelector()
+        selector.register(self.waker, EVENT_READ)
+        last_check = time.time()
 
         if __debug__:
             self.log.debug('Entering monitor loop.')
 
-        # Enter thread main loop
-        while self.active:
+        try:
+            # Enter thread main loop
+            while self.active:
+
+                # Move the queued connections to the selection pool
+                while not self.monitor_queue.empty():
+                    if __debug__:
+                        self.log.debug('In "receive timed-out connections" loop.')
+
+                    c = self.monitor_queue.get()
 
-            # Move the queued connections to the selection pool
-            while not self.monitor_queue.empty():
-                if __debug__:
-                    self.log.debug('In "receive timed-out connections" loop.')
+                    if c is None:
+                        # A non-client is a signal to die
+                        if __debug__:
+                            self.log.debug('Received a death threat.')
+                        self.stop()
+                        break
 
-                c = self.monitor_queue.get()
+                    self.log.debug('Received a timed out connection.')
 
-                if c is None:
-                    # A non-client is a signal to die
                     if __debug__:
-                        self.log.debug('Received a death threat.')
-                    self.stop()
-                    break
+                        assert(c not in self.connections)
 
-                self.log.debug('Received a timed out connection.')
+                    if IS_JYTHON:
+                        # Jython requires a socket to be in Non-blocking mode in
+                        # order to select on it.
+                        c.setblocking(False)
 
-                if __debug__:
-                    assert(c not in self.connections)
+                    if __debug__:
+                        self.log.debug('Adding connection to monitor list.')
 
-                if IS_JYTHON:
-                    # Jython requires a socket to be in Non-blocking mode in
-                    # order to select on it.
-                    c.setblocking(False)
+                    try:
+                        selector.register(c, EVENT_READ, c)
+                    except (ValueError, KeyError, IOError, OSError):
+                        # The socket was closed out from under us.
+                        c.close()
+                        continue
 
-                if __debug__:
-                    self.log.debug('Adding connection to monitor list.')
+                    self.park(c)
 
-                self.connections.add(c)
-                list_changed = True
+                try:
+                    events = selector.select(THREAD_STOP_CHECK_INTERVAL)
 
-            # Wait on those connections
-            if list_changed:
-                conn_list = list(self.connections)
-                list_changed = False
+                    if not self.active:
+                        break
 
-            try:
-                if len(conn_list):
-                    readable = select.select(conn_list,
-                                             [],
-                                             [],
-                                             THREAD_STOP_CHECK_INTERVAL)[0]
-                else:
-                    time.sleep(THREAD_STOP_CHECK_INTERVAL)
-                    readable = []
-
-                if not self.active:
-                    break
-
-                # If we have any readable connections, put them back
-                for r in readable:
-                    if __debug__:
-                        self.log.debug('Restoring readable connection')
+                    # If we have any readable connections, put them back
+                    for key, mask in events:
+                        if key.fileobj is self.waker:
+                            # We've been woken up to collect new connections
+                            # or to check if it's time to die.
+                            self.waker.consume()
+                            continue
 
-                    if IS_JYTHON:
-                        # Jython requires a socket to be in Non-blocking mode in
-                        # order to select on it, but the rest of the code requires
-                        # that it be in blocking mode.
-                        r.setblocking(True)
+                        r = key.data
+
+                        if __debug__:
+                            self.log.debug('Restoring readable connection')
+
+                        selector.unregister(r)
+                        del self.connections[r]
 
-                    r.start_time = time.time()
-                    self.active_queue.put(r)
+                        if IS_JYTHON:
+                            # Jython requires a socket to be in Non-blocking mode in
+                            # order to select on it, but the rest of the code requires
+                            # that it be in blocking mode.
+                            r.setblocking(True)
 
-                    self.connections.remove(r)
-                    list_changed = True
+                        r.start_time = time.time()
+                        self.active_queue.put(r)
 
-            except:
-                if self.active:
-                    raise
-                else:
-                    break
+                except:
+                    if self.active:
+                        raise
+                    else:
+                        break
 
-            # If we have any stale connections, kill them off.
-            if self.timeout:
+                # Wakeups can come much more often than once per
+                # THREAD_STOP_CHECK_INTERVAL.  Housekeeping doesn't need to.
                 now = time.time()
-                stale = set()
-                for c in self.connections:
-                    if (now - c.start_time) >= self.timeout:
-                        stale.add(c)
+                if now - last_check < THREAD_STOP_CHECK_INTERVAL:
+                    continue
+                last_check = now
 
-                for c in stale:
+                # If we have any stale connections, kill them off.
+                for c in self.expire(now):
                     if __debug__:
                         # "EXPR and A or B" kept for Py2.4 compatibility
                         data = (c.client_addr, c.server_port, c.ssl and '*' or '')
                         self.log.debug('Flushing stale connection: %s:%i%s' % data)
 
-                    self.connections.remove(c)
-                    list_changed = True
+                    # Unregister before closing.  Some selectors can't
+                    # forget a file descriptor that is already closed.
+                    selector.unregister(c)
 
                     try:
                         c.close()
                     finally:
                         del c
 
-            # Dynamically resize the threadpool to adapt to our changing needs.
-            self._threadpool.dynamic_resize()
-
+                # Dynamically resize the threadpool to adapt to our changing
+                # needs, unless the threadpool is resizing itself.
+                if self._threadpool is not None:
+                    self._threadpool.dynamic_resize()
+        finally:
+            if isinstance(self.monitor_queue, MonitorQueue):
+                self.monitor_queue.waker = None
+            selector.close()
+            self.waker.close()
+
+    def park(self, c):
+        """Start the idle timer for connection c.  It expires after the
+        connection's own idle_timeout or, if that is None, the Monitor's
+        timeout."""
+        timeout = c.idle_timeout
+        if timeout is None:
+            timeout = self.timeout
+
+        if not timeout:
+            self.connections[c] = None
+            return
+
+        self._sequence += 1
+        entry = (time.time() + timeout, self._sequence, c)
+        self.connections[c] = entry
+        heapq.heappush(self.deadlines, entry)
+
+        # Connections that were restored leave their entries behind.  Don't
+        # let them pile up when connections come and go a lot.
+        if len(self.deadlines) > 2 * len(self.connections) + 64:
+            self.deadlines = [e for e in self.connections.values() if e]
+            heapq.heapify(self.deadlines)
+
+    def expire(self, now):
+        """Forget and return the parked connections whose deadlines have
+        passed.  This costs O(log n) per expired entry rather than a scan of
+        every parked connection."""
+        stale = list()
+        deadlines = self.deadlines
+        while deadlines and deadlines[0][0] <= now:
+            entry = heapq.heappop(deadlines)
+            c = entry[2]
+            if self.connections.get(c) is entry:
+                del self.connections[c]
+                stale.append(c)
+        return stale
 
     def stop(self):
         self.active = False
@@ -157,12 +269,14 @@ class Monitor(Thread):
             self.log.debug('Flushing waiting connections')
 
         while self.connections:
-            c = self.connections.pop()
+            c = self.connections.popitem()[0]
             try:
                 c.close()
             finally:
                 del c
 
+        self.deadlines = list()
+
         if __debug__:
             self.log.debug('Flushing queued connections')
 
@@ -179,3 +293,7 @@ class Monitor(Thread):
 
         # Place a None sentry value to cause the monitor to die.
         self.monitor_queue.put(None)
+
+        waker = self.waker
+        if waker is not None:
+            waker.wake()
@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+
+# This file is part of the Rocket Web Server
+# Copyright (c) 2012 Timothy Farrell
+
+# Import System Modules
+import sys
+import time
+import errno
+import socket
+import select
+try:
+    import selectors
+    has_selectors = True
+except ImportError:
+    has_selectors = False
+# Import Package Modules
+from . import b
+
+# Define Constants
+WOULD_BLOCK = set([errno.EAGAIN, getattr(errno, 'EWOULDBLOCK', errno.EAGAIN)])
+
+if has_selectors:
+    EVENT_READ = selectors.EVENT_READ
+    DefaultSelector = selectors.DefaultSelector
+else:
+    EVENT_READ = 1
+
+    class SelectorKey(object):
+        __slots__ = ['fileobj', 'fd', 'events', 'data']
+
+        def __init__(self, fileobj, fd, events, data):
+            self.fileobj = fileobj
+            self.fd = fd
+            self.events = events
+            self.data = data
+
+    class DefaultSelector(object):
+        """A minimal stand-in for selectors.DefaultSelector on platforms that
+        don't have the selectors module.  It is backed by select.select() so
+        it carries the same limitations."""
+
+        def __init__(self):
+            self._keys = dict()
+
+        def _fileno(self, fileobj):
+            if isinstance(fileobj, int):
+                return fileobj
+            return fileobj.fileno()
+
+        def register(self, fileobj, events, data=None):
+            fd = self._fileno(fileobj)
+            if fd in self._keys:
+                raise KeyError('%r is already registered' % fileobj)
+            key = SelectorKey(fileobj, fd, events, data)
+            self._keys[fd] = key
+            return key
+
+        def unregister(self, fileobj):
+            return self._keys.pop(self._fileno(fileobj))
+
+        def get_map(self):
+            return self._keys
+
+        def select(self, timeout=None):
+            if not self._keys:
+                if timeout:
+                    time.sleep(timeout)
+                return []
+
+            readable = select.select(list(self._keys), [], [], timeout)[0]
+            return [(self._keys[fd], EVENT_READ) for fd in readable
+                    if fd in self._keys]
+
+        def close(self):
+            self._keys.clear()
+
+def is_readable(sock, timeout=0):
+    """Return True if sock has data (or EOF) waiting to be read.  Waits up to
+    timeout seconds for it.  By default, never blocks."""
+    if hasattr(select, 'poll'):
+        poller = select.poll()
+        poller.register(sock, select.POLLIN)
+        return bool(poller.poll(timeout * 1000))
+
+    return bool(select.select([sock], [], [], timeout)[0])
+
+class Waker(object):
+    """The Waker class is a self-pipe.  A thread blocked in select() on a
+    Waker's fileno() returns as soon as another thread calls wake()."""
+
+    def __init__(self):
+        if hasattr(socket, 'socketpair'):
+            self._reader, self._writer = socket.socketpair()
+        else:
+            # Platforms without socketpair() get a loopback connection.
+            server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            server.bind(('127.0.0.1', 0))
+            server.listen(1)
+            self._writer = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self._writer.connect(server.getsockname())
+            self._reader = server.accept()[0]
+            server.close()
+
+        self._reader.setblocking(False)
+        self._writer.setblocking(False)
+
+    def fileno(self):
+        return self._reader.fileno()
+
+    def wake(self):
+        try:
+            self._writer.send(b('x'))
+        except socket.error:
+            # A full pipe means there is already a wakeup pending.
+            pass
+
+    def consume(self):
+        try:
+            while self._reader.recv(1024):
+                pass
+        except socket.error:
+            if sys.exc_info()[1].args[0] not in WOULD_BLOCK:
+                raise
+
+    def close(self):
+        self._reader.close()
+        self._writer.close()
@@ -4,15 +4,406 @@
 # Copyright (c) 2012 Timothy Farrell
 
 # Import System Modules
+import time
+import math
+import socket
 import logging
+from collections import deque
+from threading import Event, Lock, Thread, local
+try:
+    from threading import get_ident
+except ImportError:
+    from thread import get_ident
+try:
+    from queue import Empty
+except ImportError:
+    from Queue import Empty
 # Import Package Modules
-from . import DEFAULTS, NullHandler
+from . import DEFAULTS, NullHandler, THREAD_STOP_CHECK_INTERVAL, PY3K, BUF_SIZE, b
 from .futures import has_futures, WSGIExecutor
 
+# Define Constants
+WAIT_ALPHA = 0.2 # EWMA weight of each new queue-wait sample
+BUSY_ALPHA = 0.3 # EWMA weight of each new busy-thread sample
+TARGET_WAIT = 0.05 # in secs, grow if connections wait longer than this
+TARGET_UTILIZATION = 0.75 # Fraction of threads we want busy after shrinking
+SHRINK_UTILIZATION = 0.5 # Only consider shrinking below this fraction
+SHRINK_DELAY = 5 # in secs, how long utilization must stay low to shrink
+OVERLOAD_AGE = 0.5 # in secs, the ActiveQueue is overloaded past this wait
+RETRY_AFTER = 1 # in secs, sent with the 503 response to shed connections
+OVERLOAD_RESPONSE = b('HTTP/1.1 503 Service Unavailable\r\n'
+                      'Retry-After: %i\r\n'
+                      'Content-Length: 0\r\n'
+                      'Connection: close\r\n\r\n')
+
 # Setup Logging
 log = logging.getLogger('Rocket.Errors.ThreadPool')
 log.addHandler(NullHandler())
 
+class _Waiter(object):
+    # An idle Worker blocked in ActiveQueue.get().  The lock is held except
+    # while a put() is handing the Worker its item.
+    __slots__ = ['lock', 'item', 'ident']
+
+    def __init__(self, ident):
+        self.lock = Lock()
+        self.lock.acquire()
+        self.item = None
+        self.ident = ident
+
+def _acquire(lock, timeout):
+    if PY3K:
+        return lock.acquire(True, timeout)
+
+    # Python 2 locks can't time out.  Poll like Condition.wait() does there.
+    endtime = time.time() + timeout
+    delay = 0.0005
+    while not lock.acquire(False):
+        remaining = endtime - time.time()
+        if remaining <= 0:
+            return False
+        delay = min(delay * 2, remaining, 0.05)
+        time.sleep(delay)
+    return True
+
+class ActiveQueue(object):
+    """The ActiveQueue class hands connections to Workers.  Idle Workers wait
+    on a stack, so the one that went idle most recently, and whose caches are
+    still warm, gets the next connection while the others stay idle long
+    enough for the ThreadPool to reclaim them.  A connection is handed
+    straight to an idle Worker and only queues up when every Worker is busy.
+
+    Requests known not to be urgent can be put in a separate regular lane.
+    When limit is set, at most limit Workers run regular requests at once.
+    The rest are kept for connections that haven't been read yet and for
+    priority requests.
+
+    Under overload the queue sheds connections with a canned 503 response
+    rather than let them pile up.  With maxsize set, it sheds connections put
+    while that many are already queued.  With max_age set, it sheds those
+    that waited longer than max_age by the time a Worker would take them.
+    With lifo set, Workers take the newest connection first while the oldest
+    has waited longer than overload_age, so that clients who are still
+    waiting get served before those who have probably given up.
+
+    It also keeps what the ThreadPool needs to size itself: exactly how many
+    Workers are waiting for a connection and how many are busy with one, and
+    a moving average of how long connections wait for a Worker."""
+
+    def __init__(self, maxsize=0, max_age=None, lifo=False):
+        self.mutex = Lock()
+        self.queue = deque()
+        self.wait_time = 0.0
+        self.on_backlog = None
+        # Set while a Worker waits for connections in select() rather than
+        # in get().  See listener.Acceptor.
+        self.waker = None
+
+        # Idle Workers, the most recently idle on the right
+        self._waiters = deque()
+        # Threads that got a connection and haven't asked for another yet
+        self._busy = set()
+        self._local = local()
+
+        # The regular lane and the threads running regular requests
+        self.regular = deque()
+        self.limit = None
+        self._regular = set()
+
+        # Admission control
+        self.maxsize = maxsize
+        self.max_age = max_age
+        self.lifo = lifo
+        if max_age:
+            self.overload_age = min(OVERLOAD_AGE, max_age / 2.0)
+        else:
+            self.overload_age = OVERLOAD_AGE
+        self.retry_after = RETRY_AFTER
+
+        # Metrics
+        self.dispatched = 0
+        self.rejected = 0
+        self.expired = 0
+        self.lifo_dispatched = 0
+
+    def _get_waiting(self):
+        return len(self._waiters)
+    waiting = property(_get_waiting)
+
+    def _get_busy(self):
+        return len(self._busy)
+    busy = property(_get_busy)
+
+    def _regular_free(self):
+        return self.limit is None or len(self._regular) < self.limit
+
+    def qsize(self):
+        # Only count what a Worker could take right now.
+        if self.regular and self._regular_free():
+            return len(self.queue) + len(self.regular)
+        return len(self.queue)
+
+    def empty(self):
+        return not self.qsize()
+
+    def stats(self):
+        """Return a dictionary of the queue's current state and of how many
+        connections it has dispatched and shed."""
+        self.mutex.acquire()
+        try:
+            return dict(queued = len(self.queue) + len(self.regular),
+                        waiting = len(self._waiters),
+                        busy = len(self._busy),
+                        wait_time = self.wait_time,
+                        dispatched = self.dispatched,
+                        rejected = self.rejected,
+                        expired = self.expired,
+                        lifo_dispatched = self.lifo_dispatched)
+        finally:
+            self.mutex.release()
+
+    def _full(self, item):
+        # Called with the mutex held
+        if not self.maxsize or not _is_connection(item):
+            return False
+        return len(self.queue) + len(self.regular) >= self.maxsize
+
+    def put(self, item, block=True, timeout=None):
+        self.mutex.acquire()
+        try:
+            if self._waiters:
+                if item is None:
+                    # A death threat goes to the Worker idle the longest.
+                    waiter = self._waiters.popleft()
+                else:
+                    waiter = self._waiters.pop()
+                    self._busy.add(waiter.ident)
+                    self.wait_time -= WAIT_ALPHA * self.wait_time
+                    self.dispatched += 1
+
+                waiter.item = item
+                waiter.lock.release()
+                return
+
+            if self._full(item):
+                self.rejected += 1
+            else:
+                self.queue.append((time.time(), item))
+
+                # No idle Worker to take it.  Let the ThreadPool know now
+                # rather than at its next check.  None is a Worker's death
+                # threat, not a connection.
+                if item is not None and self.on_backlog is not None:
+                    self.on_backlog()
+
+                waker = self.waker
+                if waker is not None:
+                    waker.wake()
+                return
+        finally:
+            self.mutex.release()
+
+        self.shed(item)
+
+    def put_nowait(self, item):
+        return self.put(item, False)
+
+    def put_regular(self, item):
+        """Queue item for the first Worker that isn't needed for priority
+        traffic."""
+        self.mutex.acquire()
+        try:
+            if self._waiters and self._regular_free():
+                self._hand_regular(item)
+                return
+
+            if self._full(item):
+                self.rejected += 1
+            else:
+                self.regular.append((time.time(), item))
+
+                if self._regular_free():
+                    if self.on_backlog is not None:
+                        self.on_backlog()
+
+                    waker = self.waker
+                    if waker is not None:
+                        waker.wake()
+                return
+        finally:
+            self.mutex.release()
+
+        self.shed(item)
+
+    def _hand_regular(self, item):
+        # Called with the mutex held
+        waiter = self._waiters.pop()
+        self._busy.add(waiter.ident)
+        self._regular.add(waiter.ident)
+        self.dispatched += 1
+        waiter.item = item
+        waiter.lock.release()
+
+    def claim(self):
+        """Let the calling thread run a regular request itself.  Returns False
+        if as many regular requests as allowed are already running."""
+        ident = get_ident()
+
+        self.mutex.acquire()
+        try:
+            if ident in self._regular:
+                return True
+
+            if not self._regular_free():
+                return False
+
+            self._regular.add(ident)
+            return True
+        finally:
+            self.mutex.release()
+
+    def _expire(self, lane, now, expired):
+        # Called with the mutex held.  Only the oldest end of a lane can be
+        # too old.
+        while lane and now - lane[0][0] > self.max_age and \
+              _is_connection(lane[0][1]):
+            expired.append(lane.popleft()[1])
+            self.expired += 1
+
+    def _take(self, ident, expired):
+        # Called with the mutex held.  Returns whether there was an item for
+        # the Worker with this ident, and the item.
+        now = time.time()
+        queue = self.queue
+
+        if self.max_age:
+            self._expire(queue, now, expired)
+
+        if queue:
+            if self.lifo and now - queue[0][0] > self.overload_age:
+                queued, item = queue.pop()
+                self.lifo_dispatched += 1
+            else:
+                queued, item = queue.popleft()
+
+            if item is not None:
+                self._busy.add(ident)
+                self.dispatched += 1
+                self.wait_time += WAIT_ALPHA * (now - queued - self.wait_time)
+
+            # We may have just made room for a regular request.
+            if self.regular and self._waiters and self._regular_free():
+                self._hand_regular(self.regular.popleft()[1])
+
+            return True, item
+
+        if self.regular and self._regular_free():
+            if self.max_age:
+                self._expire(self.regular, now, expired)
+
+            if self.regular:
+                self._busy.add(ident)
+                self._regular.add(ident)
+                self.dispatched += 1
+                return True, self.regular.popleft()[1]
+
+        return False, None
+
+    def get(self, block=True, timeout=None):
+        waiter = getattr(self._local, 'waiter', None)
+        if waiter is None:
+            waiter = self._local.waiter = _Waiter(get_ident())
+
+        expired = list()
+        self.mutex.acquire()
+        try:
+            self._busy.discard(waiter.ident)
+            self._regular.discard(waiter.ident)
+
+            found, item = self._take(waiter.ident, expired)
+
+            if not found:
+                if not block:
+                    raise Empty
+
+                self._waiters.append(waiter)
+        finally:
+            self.mutex.release()
+
+            for c in expired:
+                self.shed(c)
+
+        if found:
+            return item
+
+        if timeout is None:
+            waiter.lock.acquire()
+        elif not _acquire(waiter.lock, timeout):
+            self.mutex.acquire()
+            try:
+                if waiter in self._waiters:
+                    self._waiters.remove(waiter)
+                    raise Empty
+            finally:
+                self.mutex.release()
+
+            # A put() handed us an item just as we timed out.
+            waiter.lock.acquire()
+
+        item = waiter.item
+        waiter.item = None
+        return item
+
+    def get_nowait(self):
+        return self.get(False)
+
+    def shed(self, item):
+        """Turn a connection away with a 503 Service Unavailable response.
+        This never blocks."""
+        if __debug__:
+            log.debug('Shedding a connection.')
+
+        if isinstance(item, tuple):
+            # A connection straight from a Listener
+            sock = item[0][0]
+            conn = None
+            handshaken = not item[2]
+        else:
+            # A Connection or a Request handed over by another Worker
+            conn = getattr(item, 'conn', item)
+            sock = conn.socket
+            handshaken = not conn.needs_handshake
+
+        try:
+            sock.setblocking(False)
+            # Reading what the client sent keeps close() from resetting the
+            # connection before the client sees the response.
+            sock.recv(BUF_SIZE)
+        except socket.error:
+            pass
+
+        if handshaken:
+            # A TLS client that hasn't finished its handshake can't read
+            # anything we send.
+            try:
+                sock.send(OVERLOAD_RESPONSE % self.retry_after)
+            except socket.error:
+                pass
+
+        try:
+            if conn is not None:
+                conn.close()
+            else:
+                sock.close()
+        except socket.error:
+            pass
+
+def _is_connection(item):
+    # Connections, whether a Listener's tuple, a Connection or a Request, can
+    # be shed.  Death threats and the Acceptor can't.
+    return isinstance(item, tuple) or hasattr(item, 'socket') or \
+           hasattr(item, 'conn')
+
 class ThreadPool:
     """The ThreadPool class is a container class for all the worker threads. It
     manages the number of actively running threads."""
@@ -24,6 +415,8 @@ class ThreadPool:
                  monitor_queue,
                  min_threads=DEFAULTS['MIN_THREADS'],
                  max_threads=DEFAULTS['MAX_THREADS'],
+                 reserved_threads=0,
+                 priority=None,
                  ):
 
         if __debug__:
@@ -38,10 +431,19 @@ class ThreadPool:
         self.monitor_queue = monitor_queue
         self.stop_server = False
         self.alive = False
+        self.resizer = None
+        self._resize_event = Event()
 
-        # TODO - Optimize this based on some real-world usage data
+        # Only used when the active queue is a plain Queue without the
+        # measurements of an ActiveQueue.
         self.grow_threshold = int(max_threads/10) + 2
 
+        # Load controller state
+        self.busy_average = 0.0
+        self.target_wait = TARGET_WAIT
+        self.shrink_delay = SHRINK_DELAY
+        self._low_since = None
+
         if not isinstance(app_info, dict):
             app_info = dict()
 
@@ -52,11 +454,36 @@ class ThreadPool:
         app_info.update(max_threads=max_threads,
                         min_threads=min_threads)
 
+        # Keep reserved_threads of max_threads for connections that haven't
+        # been read yet and for requests whose paths start with a priority
+        # prefix.
+        self.reserved_threads = reserved_threads
+        self.priority = tuple(priority or ())
+        app_info['priority'] = self.priority
+
         self.min_threads = min_threads
         self.app_info = app_info
+        if reserved_threads and max_threads and \
+           isinstance(active_queue, ActiveQueue):
+            active_queue.limit = max(max_threads - reserved_threads, 1)
 
         self.threads = set()
 
+    def stats(self):
+        """Return a dictionary of the pool's size and, with an ActiveQueue,
+        of its load and of how many connections it turned away."""
+        stats = dict(threads = len(self.threads),
+                     min_threads = self.min_threads,
+                     max_threads = self.max_threads)
+
+        if isinstance(self.active_queue, ActiveQueue):
+            stats.update(self.active_queue.stats())
+
+        return stats
+
+    def is_priority(self, path):
+        return path.startswith(self.priority)
+
     def start(self):
         self.stop_server = False
         if __debug__:
@@ -66,6 +493,38 @@ class ThreadPool:
 
         self.alive = True
 
+    def start_resizer(self, interval=THREAD_STOP_CHECK_INTERVAL):
+        """Run dynamic_resize() every interval seconds in a thread of its own
+        until the pool is stopped."""
+        if self.resizer is not None:
+            return
+
+        self._resize_event.clear()
+        self.resizer = Thread(target=self._resize_loop,
+                              args=(interval,),
+                              name='ThreadPoolResizer')
+        self.resizer.daemon = True
+        self.resizer.start()
+
+        if isinstance(self.active_queue, ActiveQueue):
+            self.active_queue.on_backlog = self._nudge
+
+    def _nudge(self):
+        # Called by the ActiveQueue with its lock held.  Keep it short.
+        if self.max_threads and len(self.threads) >= self.max_threads:
+            return
+        self._resize_event.set()
+
+    def _resize_loop(self, interval):
+        while True:
+            self._resize_event.wait(interval)
+            self._resize_event.clear()
+
+            if self.stop_server:
+                return
+
+            self.dynamic_resize()
+
     def stop(self):
         self.alive = False
 
@@ -74,6 +533,14 @@ class ThreadPool:
 
         self.stop_server = True
 
+        # The resizer must not grow or shrink the pool while we empty it.
+        if self.resizer is not None:
+            if isinstance(self.active_queue, ActiveQueue):
+                self.active_queue.on_backlog = None
+            self._resize_event.set()
+            self.resizer.join()
+            self.resizer = None
+
         # Prompt the threads to die
         self.shrink(len(self.threads))
 
@@ -92,7 +559,7 @@ class ThreadPool:
 
         # Wait until they pull the trigger
         for t in self.threads:
-            if t.isAlive():
+            if t.is_alive():
                 t.join()
 
         # Clean up the mess
@@ -101,7 +568,7 @@ class ThreadPool:
     def bring_out_your_dead(self):
         # Remove dead threads from the pool
 
-        dead_threads = [t for t in self.threads if not t.isAlive()]
+        dead_threads = [t for t in self.threads if not t.is_alive()]
         for t in dead_threads:
             if __debug__:
                 log.debug("Removing dead thread: %s." % t.getName())
@@ -148,6 +615,10 @@ class ThreadPool:
             if self.check_for_dead_threads > 0:
                 self.bring_out_your_dead()
 
+            if isinstance(self.active_queue, ActiveQueue):
+                self._resize_for_load()
+                return
+
             queueSize = self.active_queue.qsize()
             threadCount = len(self.threads)
 
@@ -161,3 +632,88 @@ class ThreadPool:
             elif queueSize > self.grow_threshold:
 
                 self.grow(queueSize)
+
+    def _resize_for_load(self):
+        queue = self.active_queue
+        backlog = queue.qsize()
+        idle = queue.waiting
+        threadCount = len(self.threads)
+
+        busy = queue.busy
+        self.busy_average += BUSY_ALPHA * (busy - self.busy_average)
+
+        if __debug__:
+            log.debug("Examining ThreadPool. %i threads, %i idle, %i busy, "
+                      "%i Q'd conxions, %.1f busy on average, %.3fs average "
+                      "wait" % (threadCount, idle, busy, backlog,
+                                self.busy_average, queue.wait_time))
+
+        # Grow right away, but only by as many threads as there are
+        # connections with no Worker to take them.  If connections have been
+        # waiting too long and every Worker is busy, add one more.
+        deficit = backlog - idle
+        if deficit <= 0 and idle == 0 and queue.wait_time > self.target_wait:
+            deficit = 1
+
+        if deficit > 0:
+            self._low_since = None
+            self.grow(deficit)
+            return
+
+        # Shrink only after utilization has stayed low for a while so that
+        # the pool doesn't shrink between the bursts of a busy period.
+        if threadCount <= self.min_threads or \
+           self.busy_average >= SHRINK_UTILIZATION * threadCount:
+            self._low_since = None
+            return
+
+        now = time.time()
+        if self._low_since is None:
+            self._low_since = now
+            return
+
+        if now - self._low_since < self.shrink_delay:
+            return
+
+        self._low_since = None
+        target = int(math.ceil(self.busy_average / TARGET_UTILIZATION))
+        target = max(target, self.min_threads)
+        if target < threadCount:
+            self.shrink(threadCount - target)
+
+class Router(object):
+    """The Router class decides which ThreadPool serves what when Rocket runs
+    several of them.  Connections go to the pool bound to the port they
+    arrived on.  Requests go to the pool bound to the longest prefix of their
+    path, or else to the pool of their port."""
+
+    def __init__(self, default):
+        self.default = default
+        self.ports = dict()
+        self.prefixes = list()
+
+    def add(self, pool, ports=(), prefixes=()):
+        for port in ports:
+            self.ports[port] = pool
+
+        for prefix in prefixes:
+            self.prefixes.append((prefix, pool))
+
+        # Longest prefixes first so that the most specific one wins
+        self.prefixes.sort(key=lambda x: len(x[0]), reverse=True)
+
+    def pool_for_port(self, port):
+        return self.ports.get(port, self.default)
+
+    def route(self, path, port):
+        for prefix, pool in self.prefixes:
+            if path.startswith(prefix):
+                return pool
+
+        return self.pool_for_port(port)
+
+    def put(self, conn, block=True, timeout=None):
+        # The Monitor hands readable connections back through here.
+        self.pool_for_port(conn.server_port).active_queue.put(conn,
+                                                              block,
+                                                              timeout)
@@ -6,10 +6,10 @@
 # Import System Modules
 import re
 import sys
+import time
 import socket
 import logging
 import traceback
-from wsgiref.headers import Headers
 from threading import Thread
 from datetime import datetime
 
@@ -32,25 +32,19 @@ except ImportError:
     class SSLError(socket.error):
         pass
 # Import Package Modules
-from . import IGNORE_ERRORS_ON_CLOSE, b, PY3K, NullHandler, IS_JYTHON
+from . import IGNORE_ERRORS_ON_CLOSE, b, PY3K, NullHandler, IS_JYTHON, DEFAULTS
+from . import BUF_SIZE, HTTP_SERVER_SOFTWARE
 from .connection import Connection
+from .listener import Acceptor
+
+if PY3K:
+    from email.utils import formatdate
+else:
+    # Caps Utils for Py2.4 compatibility
+    from email.Utils import formatdate
 
 # Define Constants
 re_SLASH = re.compile('%2F', re.IGNORECASE)
-re_REQUEST_LINE = re.compile(r"""^
-(?P<method>OPTIONS|GET|HEAD|POST|PUT|DELETE|TRACE|CONNECT)   # Request Method
-\                                                            # (single space)
-(
-    (?P<scheme>[^:/]+)                                       # Scheme
-    (://)  #
-    (?P<host>[^/]+)                                          # Host
-)? #
-(?P<path>(\*|/[^ \?]*))                                      # Path
-(\? (?P<query_string>[^ ]*))?                                # Query String
-\                                                            # (single space)
-(?P<protocol>HTTPS?/1\.[01])                                 # Protocol
-$
-""", re.X)
 LOG_LINE = '%(client_ip)s - "%(request_line)s" - %(status)s %(size)s'
 RESPONSE = '''\
 %s %s
@@ -59,8 +53,30 @@ Content-Type: %s
 
 %s
 '''
-if IS_JYTHON:
-    HTTP_METHODS = set(['OPTIONS', 'GET', 'HEAD', 'POST', 'PUT', 'DELETE', 'TRACE', 'CONNECT'])
+# Any token is a valid method (RFC 7230, section 3.2.6)
+TOKEN_CHARS = b("!#$%&'*+-.^_`|~0123456789"
+                "ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz")
+PROTOCOLS = dict([(b(p), p) for p in ('HTTP/1.0', 'HTTP/1.1',
+                                      'HTTPS/1.0', 'HTTPS/1.1')])
+PATH_CACHE_SIZE = 1024
+METHOD_CACHE_SIZE = 64
+HEADER_NAME_CACHE_SIZE = 256
+END_OF_HEAD = (b('\r\n'), b('\n'))
+HEX_DIGITS = b('0123456789abcdefABCDEF')
+COMMON_HEADERS = ('Accept', 'Accept-Charset', 'Accept-Encoding',
+                  'Accept-Language', 'Authorization', 'Cache-Control',
+                  'Connection', 'Content-Length', 'Content-Type', 'Cookie',
+                  'Expect', 'Forwarded', 'Host', 'If-Match',
+                  'If-Modified-Since', 'If-None-Match', 'If-Range',
+                  'Keep-Alive', 'Origin', 'Pragma', 'Range', 'Referer', 'TE',
+                  'Transfer-Encoding', 'Upgrade', 'User-Agent', 'Via',
+                  'X-Forwarded-For', 'X-Forwarded-Host', 'X-Forwarded-Proto',
+                  'X-Real-IP', 'X-Requested-With')
+STATUS_LINE_CACHE_SIZE = 64
+SERVER_HEADER = b('Server: %s\r\n' % HTTP_SERVER_SOFTWARE)
+# Response headers the server needs to know the values of
+SERVED_HEADERS = frozenset(['connection', 'content-length', 'date', 'server',
+                            'transfer-encoding'])
 
 class Worker(Thread):
     """The Worker class is a base class responsible for receiving connections
@@ -85,6 +101,19 @@ class Worker(Thread):
         self.closeConnection = True
         self.request_line = ""
         self.protocol = 'HTTP/1.1'
+        # A Request read by another Worker for us to run, and whether we gave
+        # the current one to another Worker.
+        self.handoff = None
+        self.handed_off = False
+
+        # Limits on what a client may send before its request runs
+        self.max_header_size = app_info.get('max_header_size',
+                                            DEFAULTS['MAX_HEADER_SIZE'])
+        self.max_headers = app_info.get('max_headers',
+                                        DEFAULTS['MAX_HEADERS'])
+        self.max_chunk_size = app_info.get('max_chunk_size')
+        self.max_body_size = app_info.get('max_body_size')
+        self.spool_size = app_info.get('spool_size')
 
         # Request Log
         self.req_log = logging.getLogger('Rocket.Requests')
@@ -108,10 +137,13 @@ class Worker(Thread):
             if __debug__:
                 self.err_log.debug('Client closed socket')
             return False
-        if typ == BadRequest:
+        if issubclass(typ, BadRequest):
             self.closeConnection = True
             if __debug__:
                 self.err_log.debug('Client sent a bad request')
+            # The error response has been sent.  Don't leave the client
+            # waiting for more.
+            self.conn.close()
             return True
         if typ == socket.error:
             self.closeConnection = True
@@ -147,11 +179,33 @@ class Worker(Thread):
                     self.err_log.debug('Received a death threat.')
                 return conn
 
+            if isinstance(conn, Acceptor):
+                # It's our turn to accept a connection ourselves.
+                conn = conn.lead()
+                if conn is None:
+                    continue
+
+            if isinstance(conn, Request):
+                # Another Worker already read this request.  Run it.
+                self.handoff = conn
+                self.request_line = conn.request_line
+                self.protocol = conn.protocol
+                conn = conn.conn
+
             if isinstance(conn, tuple):
                 conn = Connection(*conn)
 
             self.conn = conn
 
+            if conn.needs_handshake:
+                try:
+                    conn.handshake()
+                except socket.error:
+                    if __debug__:
+                        self.err_log.debug('TLS handshake failed.')
+                    conn.close()
+                    continue
+
             if conn.ssl != conn.secure:
                 self.err_log.info('Received HTTP connection on HTTPS port.')
                 self.send_response('400 Bad Request')
@@ -167,6 +221,7 @@ class Worker(Thread):
             while True:
                 if __debug__:
                     self.err_log.debug('Serving a request')
+                self.handed_off = False
                 try:
                     self.run_app(conn)
                 except:
@@ -175,7 +230,8 @@ class Worker(Thread):
                     if handled:
                         break
                 finally:
-                    if self.request_line:
+                    self.handoff = None
+                    if self.request_line and not self.handed_off:
                         log_info = dict(client_ip = conn.client_addr,
                                         time = datetime.now().strftime('%c'),
                                         status = self.status.split(' ')[0],
@@ -183,6 +239,10 @@ class Worker(Thread):
                                         request_line = self.request_line)
                         self.req_log.info(LOG_LINE % log_info)
 
+                if self.handed_off:
+                    # The connection belongs to another Worker now.
+                    break
+
                 if self.closeConnection:
                     try:
                         conn.close()
@@ -191,12 +251,58 @@ class Worker(Thread):
 
                     break
 
+                if not IS_JYTHON and not conn.has_pending():
+                    # The client hasn't sent its next request yet.  Rather than
+                    # wait up to SOCKET_TIMEOUT for it, let the Monitor watch
+                    # the connection and go serve someone else.
+                    if __debug__:
+                        self.err_log.debug('Parking idle keep-alive connection.')
+                    conn.start_time = time.time()
+                    self.monitor_queue.put(conn)
+                    break
+
     def run_app(self, conn):
         # Must be overridden with a method reads the request from the socket
         # and sends a response.
         self.closeConnection = True
         raise NotImplementedError('Overload this method!')
 
+    def hand_off(self, path, sock_file, environ):
+        """Find the ThreadPool that should run the request for path.  If it is
+        not ours, or this request must leave our reserved threads alone, hand
+        it over and return True.  Return False to run it here."""
+        router = self.app_info.get('router')
+        if router is not None:
+            pool = router.route(path, self.conn.server_port)
+            priority = pool.is_priority(path)
+            queue = pool.active_queue
+        else:
+            priority = path.startswith(self.app_info.get('priority', ()))
+            queue = self.active_queue
+
+        if queue is self.active_queue:
+            if priority or getattr(queue, 'limit', None) is None:
+                return False
+
+            if queue.claim():
+                return False
+
+        request = Request(self.conn,
+                          sock_file,
+                          environ,
+                          self.request_line,
+                          self.protocol)
+        if priority:
+            queue.put(request)
+        else:
+            queue.put_regular(request)
+
+        if __debug__:
+            self.err_log.debug('Handed off request for %s.' % path)
+
+        self.handed_off = True
+        return True
+
     def send_response(self, status):
         stat_msg = status.split(' ', 1)[1]
         msg = RESPONSE % (self.protocol,
@@ -213,23 +319,24 @@ class Worker(Thread):
 
     def read_request_line(self, sock_file):
         self.request_line = ''
+        limit = self.max_header_size + 1
         try:
             # Grab the request line
-            d = sock_file.readline()
-            if PY3K:
-                d = d.decode('ISO-8859-1')
+            d = sock_file.readline(limit)
 
-            if d == '\r\n':
+            if d == b('\r\n'):
                 # Allow an extra NEWLINE at the beginning per HTTP 1.1 spec
                 if __debug__:
                     self.err_log.debug('Client sent newline')
 
-                d = sock_file.readline()
-                if PY3K:
-                    d = d.decode('ISO-8859-1')
+                d = sock_file.readline(limit)
         except socket.timeout:
             raise SocketTimeout("Socket timed out before request.")
 
+        if len(d) == limit:
+            self.send_response('414 Request-URI Too Long')
+            raise BadRequest
+
         d = d.strip()
 
         if not d:
@@ -237,105 +344,236 @@ class Worker(Thread):
                 self.err_log.debug('Client did not send a recognizable request.')
             raise SocketClosed('Client closed socket.')
 
-        self.request_line = d
-
-        # NOTE: I've replaced the traditional method of procedurally breaking
-        # apart the request line with a (rather unsightly) regular expression.
-        # However, Java's regexp support sucks so bad that it actually takes
-        # longer in Jython to process the regexp than procedurally. So I've
-        # left the old code here for Jython's sake...for now.
-        if IS_JYTHON:
-            return self._read_request_line_jython(d)
+        req = parse_request_line(d)
 
-        match = re_REQUEST_LINE.match(d)
+        if PY3K:
+            d = d.decode('ISO-8859-1')
+        self.request_line = d
 
-        if not match:
+        if req is None:
             self.send_response('400 Bad Request')
             raise BadRequest
 
-        req = match.groupdict()
-        for k,v in req.items():
-            if not v:
-                req[k] = ""
-            if k == 'path':
-                req['path'] = r'%2F'.join([unquote(x) for x in re_SLASH.split(v)])
-
         self.protocol = req['protocol']
         return req
 
-    def _read_request_line_jython(self, d):
-        d = d.strip()
+    def read_headers(self, sock_file):
+        """Read the request head up to the blank line that ends it and return
+        its headers keyed by their CGI names (without the HTTP_ prefix).  A
+        head larger than max_header_size or with more than max_headers
+        header lines gets a 431 response."""
+        size = 0
+        lines = list()
         try:
-            method, uri, proto = d.split(' ')
-            if not proto.startswith('HTTP') or \
-               proto[-3:] not in ('1.0', '1.1') or \
-               method not in HTTP_METHODS:
+            while True:
+                l = sock_file.readline(self.max_header_size - size + 1)
+
+                if l in END_OF_HEAD:
+                    break
+
+                if not l:
+                    raise SocketClosed('Client closed socket.')
+
+                size += len(l)
+                lines.append(l)
+
+                if size > self.max_header_size or \
+                   len(lines) > self.max_headers:
+                    self.send_response('431 Request Header Fields Too Large')
+                    raise BadRequest
+        except socket.timeout:
+            raise SocketTimeout("Socket timed out before request.")
+
+        # Decode and parse the whole head at once.  HTTP header values are
+        # latin-1 encoded.
+        head = b('').join(lines)
+        if PY3K:
+            head = head.decode('ISO-8859-1')
+
+        headers = dict()
+        lname = None
+        for l in head.split('\n')[:-1]:
+            if l[:1] in (' ', '\t'):
+                # Some headers take more than one line
+                if lname is None:
+                    self.send_response('400 Bad Request')
+                    raise BadRequest
+                headers[lname] += ',' + l.strip()
+                continue
+
+            name, colon, value = l.partition(':')
+            if not colon:
                 self.send_response('400 Bad Request')
                 raise BadRequest
-        except ValueError:
-            self.send_response('400 Bad Request')
-            raise BadRequest
 
-        req = dict(method=method, protocol = proto)
-        scheme = ''
-        host = ''
-        if uri == '*' or uri.startswith('/'):
-            path = uri
-        elif '://' in uri:
-            scheme, rest = uri.split('://')
-            host, path = rest.split('/', 1)
-            path = '/' + path
-        else:
-            self.send_response('400 Bad Request')
-            raise BadRequest
+            lname = header_name(name)
+            headers[lname] = value.strip()
 
-        query_string = ''
-        if '?' in path:
-            path, query_string = path.split('?', 1)
+        return headers
 
-        path = r'%2F'.join([unquote(x) for x in re_SLASH.split(path)])
+_path_cache = dict()
+_methods = dict()
+_header_names = dict()
+_status_lines = dict()
+_date_header = (None, None)
 
-        req.update(path=path,
-                   query_string=query_string,
-                   scheme=scheme.lower(),
-                   host=host)
-        return req
+def header_name(name):
+    """Return the CGI form of a header name (e.g. "Content-Type" becomes
+    "CONTENT_TYPE").  Common names are looked up in a precomputed table;
+    others are cached as they show up."""
+    try:
+        return _header_names[name]
+    except KeyError:
+        pass
 
+    lname = str(name.strip().upper().replace('-', '_'))
 
-    def read_headers(self, sock_file):
-        try:
-            headers = dict()
-            l = sock_file.readline()
-    
-            lname = None
-            lval = None
-            while True:
-                if PY3K:
-                    try:
-                        l = str(l, 'ISO-8859-1')
-                    except UnicodeDecodeError:
-                        self.err_log.warning('Client sent invalid header: ' + repr(l))
-    
-                if l == '\r\n':
-                    break
-    
-                if l[0] in ' \t' and lname:
-                    # Some headers take more than one line
-                    lval += ',' + l.strip()
-                else:
-                    # HTTP header values are latin-1 encoded
-                    l = l.split(':', 1)
-                    # HTTP header names are us-ascii encoded
-    
-                    lname = l[0].strip().upper().replace('-', '_')
-                    lval = l[-1].strip()
-                headers[str(lname)] = str(lval)
-    
-                l = sock_file.readline()
-        except socket.timeout:
-            raise SocketTimeout("Socket timed out before request.")
+    # Clients choose the names.  Don't let them grow the cache forever.
+    if len(_header_names) < HEADER_NAME_CACHE_SIZE:
+        _header_names[name] = lname
 
-        return headers
+    return lname
+
+for name in COMMON_HEADERS:
+    header_name(name)
+    header_name(name.lower())
+del name
+
+def unquote_path(path):
+    """Percent-decode a request path, except for encoded slashes.  Decoded
+    paths are cached since clients keep asking for the same ones."""
+    try:
+        return _path_cache[path]
+    except KeyError:
+        pass
+
+    unquoted = r'%2F'.join([unquote(x) for x in re_SLASH.split(path)])
+
+    if len(_path_cache) >= PATH_CACHE_SIZE:
+        _path_cache.clear()
+    _path_cache[path] = unquoted
+
+    return unquoted
+
+def parse_request_line(line):
+    """Split a request line (bytes without the line ending) into its method,
+    scheme, host, path, query_string and protocol.  Returns None if the line
+    is malformed."""
+    parts = line.split(b(' '))
+    if len(parts) != 3:
+        return None
+
+    method, uri, protocol = parts
+    protocol = PROTOCOLS.get(protocol)
+    if protocol is None:
+        return None
+
+    try:
+        method = _methods[method]
+    except KeyError:
+        if not method or method.translate(None, TOKEN_CHARS):
+            return None
+
+        name = method
+        if PY3K:
+            name = method.decode('ISO-8859-1')
+
+        # Clients choose the method.  Don't let them grow the cache forever.
+        if len(_methods) < METHOD_CACHE_SIZE:
+            _methods[method] = name
+        method = name
+
+    target, q, query_string = uri.partition(b('?'))
+    scheme = host = ''
+
+    if target[:1] == b('/'):
+        path = target
+    elif target == b('*'):
+        path = target
+    else:
+        # An absolute URI.  Its path must at least be "/".
+        scheme, sep, rest = target.partition(b('://'))
+        host, slash, path = rest.partition(b('/'))
+        if not sep or not scheme or b(':') in scheme or b('/') in scheme or \
+           not host or not slash:
+            return None
+        path = slash + path
+
+    if PY3K:
+        path = path.decode('ISO-8859-1')
+        if query_string:
+            query_string = query_string.decode('ISO-8859-1')
+        else:
+            query_string = ''
+        if scheme:
+            scheme = scheme.decode('ISO-8859-1')
+            host = host.decode('ISO-8859-1')
+
+    if '%' in path:
+        path = unquote_path(path)
+
+    return dict(method = method,
+                scheme = scheme,
+                host = host,
+                path = path,
+                query_string = query_string,
+                protocol = protocol)
+
+def status_line(status):
+    """Return the encoded status line for status (e.g. "200 OK").  The
+    handful of statuses an application uses are only encoded once."""
+    try:
+        return _status_lines[status]
+    except KeyError:
+        pass
+
+    line = b('HTTP/1.1 %s\r\n' % status)
+
+    if len(_status_lines) < STATUS_LINE_CACHE_SIZE:
+        _status_lines[status] = line
+
+    return line
+
+def date_header():
+    """Return the encoded Date header line for the current second.  It is
+    only formatted once a second, however many responses are sent."""
+    global _date_header
+    now = int(time.time())
+    second, line = _date_header
+    if second != now:
+        line = b('Date: %s\r\n' % formatdate(now, usegmt=True))
+        _date_header = (now, line)
+    return line
+
+def encode_headers(headers):
+    """Encode a list of (name, value) response headers as header lines.
+    Returns the lines as bytes along with a dict of the values of any
+    SERVED_HEADERS among them, keyed by lower case name.  Raises TypeError
+    for a name or value that isn't a native string and UnicodeError for one
+    that isn't Latin-1."""
+    found = dict()
+    lines = list()
+    for name, value in headers:
+        lname = name.lower()
+        if lname in SERVED_HEADERS:
+            found[lname] = value
+        lines.append(name + ': ' + value + '\r\n')
+
+    data = ''.join(lines)
+    if not isinstance(data, bytes):
+        data = data.encode('ISO-8859-1')
+    return data, found
+
+class Request(object):
+    """A request that one Worker has read and another Worker will run."""
+    __slots__ = ['conn', 'sock_file', 'environ', 'request_line', 'protocol']
+
+    def __init__(self, conn, sock_file, environ, request_line, protocol):
+        self.conn = conn
+        self.sock_file = sock_file
+        self.environ = environ
+        self.request_line = request_line
+        self.protocol = protocol
 
 class SocketTimeout(Exception):
     "Exception for when a socket times out between requests."
@@ -343,58 +581,243 @@ class SocketTimeout(Exception):
 
 class BadRequest(Exception):
     "Exception for when a client sends an incomprehensible request."
-    pass
+    status = '400 Bad Request'
+
+class RequestTooLarge(BadRequest):
+    "Exception for when a client sends a body larger than we will take."
+    status = '413 Request Entity Too Large'
 
 class SocketClosed(Exception):
     "Exception for when a socket is closed by the client."
     pass
 
 class ChunkedReader(object):
-    def __init__(self, sock_file):
+    """The ChunkedReader class decodes a request body sent with
+    Transfer-Encoding: chunked as the application reads it.  Chunks larger
+    than max_chunk_size or bodies larger than max_body_size are refused with
+    RequestTooLarge, and malformed framing with BadRequest.  The reader
+    sends no response itself; its exceptions carry the status to send.
+    Trailers are read into the trailers dict once the last
+    chunk is reached so that the connection can serve another request."""
+
+    def __init__(self,
+                 sock_file,
+                 max_chunk_size=None,
+                 max_body_size=None,
+                 max_header_size=DEFAULTS['MAX_HEADER_SIZE']):
         self.stream = sock_file
+        self.max_chunk_size = max_chunk_size
+        self.max_body_size = max_body_size
+        self.max_header_size = max_header_size
+        # Bytes left to read in the current chunk
         self.chunk_size = 0
+        # Bytes of body announced so far
+        self.size = 0
+        self.chunks = 0
+        self.done = False
+        self.trailers = dict()
 
-    def _read_header(self):
-        chunk_len = ""
-        try:
-            while "" == chunk_len:
-                chunk_len = self.stream.readline().strip()
-            return int(chunk_len, 16)
-        except ValueError:
-            return 0
+    def _readline(self):
+        line = self.stream.readline(self.max_header_size + 1)
+        if not line:
+            raise SocketClosed('Client closed socket.')
+        if len(line) > self.max_header_size:
+            raise BadRequest('Chunk header too long.')
+        return line
+
+    def _next_chunk(self):
+        if self.chunks and self._readline().strip():
+            raise BadRequest('Chunk not followed by CRLF.')
+
+        line = self._readline()
+        # Chunk extensions are ignored.  The size itself must be nothing but
+        # hex digits: int() would also take a sign, a 0x prefix or
+        # underscores, which a proxy in front of us might read differently.
+        size = line.split(b(';'), 1)[0].rstrip()
+        if not size or size.strip(HEX_DIGITS):
+            raise BadRequest('Invalid chunk size: %r' % line)
+        size = int(size, 16)
+
+        if self.max_chunk_size is not None and size > self.max_chunk_size:
+            raise RequestTooLarge('Chunk too large.')
+
+        self.size += size
+        if self.max_body_size is not None and self.size > self.max_body_size:
+            raise RequestTooLarge('Request body too large.')
+
+        self.chunks += 1
+        self.chunk_size = size
+
+        if not size:
+            self._read_trailers()
+            self.done = True
+
+    def _read_trailers(self):
+        size = 0
+        while True:
+            line = self._readline()
+            if line in END_OF_HEAD:
+                break
+
+            size += len(line)
+            if size > self.max_header_size:
+                raise BadRequest('Trailers too long.')
 
-    def read(self, size):
-        data = b('')
-        chunk_size = self.chunk_size
+            if PY3K:
+                line = line.decode('ISO-8859-1')
+            name, colon, value = line.partition(':')
+            if colon:
+                self.trailers[header_name(name)] = value.strip()
+
+    def _available(self):
+        """Return the number of bytes that can be read from the current
+        chunk, reading the next chunk's header if needed.  Returns 0 at the
+        end of the body."""
+        if not self.chunk_size and not self.done:
+            self._next_chunk()
+        return self.chunk_size
+
+    def readinto(self, buf):
+        view = memoryview(buf)
+        size = len(view)
+        n = 0
+        while n < size:
+            want = min(size - n, self._available())
+            if not want:
+                break
+
+            received = self.stream.readinto(view[n:n + want])
+            if not received:
+                raise SocketClosed('Client closed socket.')
+
+            n += received
+            self.chunk_size -= received
+        return n
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = sys.maxsize
+
+        pieces = list()
         while size:
-            if not chunk_size:
-                chunk_size = self._read_header()
+            n = min(size, self._available())
+            if not n:
+                break
 
-            if size < chunk_size:
-                data += self.stream.read(size)
-                chunk_size -= size
+            data = self.stream.read(n)
+            if not data:
+                raise SocketClosed('Client closed socket.')
+
+            pieces.append(data)
+            self.chunk_size -= len(data)
+            size -= len(data)
+        return b('').join(pieces)
+
+    def readline(self, size=-1):
+        if size is None or size < 0:
+            size = sys.maxsize
+
+        pieces = list()
+        while size:
+            n = min(size, self._available())
+            if not n:
                 break
-            else:
-                if not chunk_size:
-                    break
-                data += self.stream.read(chunk_size)
-                size -= chunk_size
-                chunk_size = 0
 
-        self.chunk_size = chunk_size
-        return data
+            data = self.stream.readline(n)
+            if not data:
+                raise SocketClosed('Client closed socket.')
 
-    def readline(self):
-        data = b('')
-        c = self.read(1)
-        while c and c != b('\n'):
-            data += c
-            c = self.read(1)
-        data += c
+            pieces.append(data)
+            self.chunk_size -= len(data)
+            size -= len(data)
+            if data.endswith(b('\n')):
+                break
+        return b('').join(pieces)
+
+    def readlines(self, hint=None):
+        return list(self)
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        line = self.readline()
+        if not line:
+            raise StopIteration
+        return line
+
+    __next__ = next
+
+class LengthReader(object):
+    """The LengthReader class reads a request body whose size was given by
+    Content-Length.  Reads stop at the end of the body so that nobody reads
+    into the request after it."""
+
+    def __init__(self, sock_file, length):
+        self.stream = sock_file
+        self.remaining = length
+
+    def _limit(self, size):
+        if size is None or size < 0 or size > self.remaining:
+            return self.remaining
+        return size
+
+    def _consumed(self, data):
+        if not data:
+            raise SocketClosed('Client closed socket.')
+        self.remaining -= len(data)
         return data
 
-    def readlines(self):
-        yield self.readline()
+    def read(self, size=-1):
+        size = self._limit(size)
+        if not size:
+            return b('')
+        return self._consumed(self.stream.read(size))
+
+    def readline(self, size=-1):
+        size = self._limit(size)
+        if not size:
+            return b('')
+        return self._consumed(self.stream.readline(size))
+
+    def readinto(self, buf):
+        view = memoryview(buf)
+        size = self._limit(len(view))
+        if not size:
+            return 0
+        n = self.stream.readinto(view[:size])
+        if not n:
+            raise SocketClosed('Client closed socket.')
+        self.remaining -= n
+        return n
+
+    def readlines(self, hint=None):
+        return list(self)
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        line = self.readline()
+        if not line:
+            raise StopIteration
+        return line
+
+    __next__ = next
+
+    def drain(self, limit):
+        """Read and throw away what is left of the body, if that is no more
+        than limit bytes.  Returns True if the connection can read its next
+        request."""
+        if self.remaining > limit:
+            return False
+
+        try:
+            while self.remaining:
+                self.read(BUF_SIZE)
+        except (socket.error, SocketClosed):
+            return False
+        return True
 
 def get_method(method):
     from .methods.wsgi import WSGIWorker
@@ -76,6 +76,61 @@ class ChunkedReaderTest(unittest.TestCase):
         for line in answer.readlines():
             self.assertEqual(line, chunky.readline())
 
+    def testReadLines(self):
+        chunky = worker.ChunkedReader(StringIO(SAMPLE_CHUNKED_REQUEST))
+        answer = StringIO(SAMPLE_CHUNKED_ANSWER)
+
+        self.assertEqual(chunky.readlines(), answer.readlines())
+
+    def testReadInto(self):
+        chunky = worker.ChunkedReader(StringIO(SAMPLE_CHUNKED_REQUEST))
+
+        buf = bytearray(len(SAMPLE_CHUNKED_ANSWER) + 10)
+        n = chunky.readinto(buf)
+        self.assertEqual(n, len(SAMPLE_CHUNKED_ANSWER))
+        self.assertEqual(bytes(buf[:n]), SAMPLE_CHUNKED_ANSWER)
+        self.assertEqual(chunky.readinto(buf), 0)
+
+    def testTrailers(self):
+        io = StringIO(b('4;ext=1\r\nbody\r\n0\r\n'
+                        'Content-MD5: abc\r\n\r\n'
+                        'GET / HTTP/1.1\r\n'))
+        chunky = worker.ChunkedReader(io)
+
+        self.assertEqual(chunky.read(), b('body'))
+        self.assertEqual(chunky.trailers, {'CONTENT_MD5': 'abc'})
+
+        # The next request is left for the Worker
+        self.assertEqual(io.readline(), b('GET / HTTP/1.1\r\n'))
+
+    def testLargeBody(self):
+        body = b('x') * 100000
+        request = b('').join([b('%x\r\n' % 1000) + body[i:i + 1000] + b('\r\n')
+                              for i in range(0, len(body), 1000)])
+        request += b('0\r\n\r\n')
+
+        chunky = worker.ChunkedReader(StringIO(request))
+        self.assertEqual(chunky.read(), body)
+
+    def testLimits(self):
+        for request, kwargs in [(SAMPLE_CHUNKED_REQUEST, dict(max_chunk_size=0x1C)),
+                                (SAMPLE_CHUNKED_REQUEST, dict(max_body_size=60)),
+                                (b('-1\r\n\r\n'), dict()),
+                                (b('zz\r\n\r\n'), dict()),
+                                (b('+0x2\r\nab\r\n0\r\n\r\n'), dict()),
+                                (b('1_0\r\n') + b('a') * 16 + b('\r\n0\r\n\r\n'), dict()),
+                                (b('-0\r\n\r\n'), dict()),
+                                (b('1 0\r\n') + b('a') * 16 + b('\r\n0\r\n\r\n'), dict()),
+                                (b('\r\nab\r\n0\r\n\r\n'), dict()),
+                                (b(';ext=1\r\n\r\n'), dict()),
+                                (b('3\r\nabcdef\r\n0\r\n\r\n'), dict()),
+                                (b('0\r\n') + b('X: y\r\n') * 100 + b('\r\n'),
+                                 dict(max_header_size=256))]:
+            chunky = worker.ChunkedReader(StringIO(request), **kwargs)
+            self.assertRaises(worker.BadRequest, chunky.read)
+
+        chunky = worker.ChunkedReader(StringIO(b('5\r\nab')))
+        self.assertRaises(worker.SocketClosed, chunky.read)
 
 if __name__ == '__main__':
     unittest.main()
@@ -6,16 +6,25 @@
 # See the included LICENSE.txt file for licensing details.
 
 # Import System Modules
+import os
 import sys
 import time
 import socket
 import logging
+import threading
 import unittest
+try:
+    import ssl
+    HAS_SSL = True
+except ImportError:
+    HAS_SSL = False
 # Import Custom Modules
 from rocket import Rocket, connection, SOCKET_TIMEOUT, b
 
 # Constants
 SERVER_PORT_START = 44450
+PRIV_KEY_FILE = os.path.join(os.path.dirname(__file__), "cert_key.pem")
+PUB_KEY_FILE = os.path.join(os.path.dirname(__file__), "cert.pem")
 
 # Define Tests
 class ConnectionTest(unittest.TestCase):
@@ -54,6 +63,15 @@ class ConnectionTest(unittest.TestCase):
             self.assertTrue(hasattr(c, m),
                          msg="Connection object does not have %s " % m)
 
+    def testEnviron(self):
+        c = connection.Connection(*(self.server.active_queue.get(timeout=10)))
+
+        self.assertEqual(c.environ,
+                         {'SERVER_PORT': str(self.starttuple[1]),
+                          'REMOTE_PORT': str(self.sock.getsockname()[1]),
+                          'REMOTE_ADDR': '127.0.0.1',
+                          'wsgi.url_scheme': 'http'})
+
     def testSocketTimeout(self):
         c = connection.Connection(*(self.server.active_queue.get(timeout=10)))
 
@@ -130,5 +148,154 @@ class ConnectionTest(unittest.TestCase):
         f.close()
         c.close()
 
+    def testWritev(self):
+        c = connection.Connection(*(self.server.active_queue.get(timeout=10)))
+
+        # More than the socket will take in one call
+        buffers = [b('header\r\n'), b(''), b('0123456789') * 100000, b('end')]
+        writer = threading.Thread(target=c.writev, args=(buffers,))
+        writer.start()
+
+        data = b('')
+        while len(data) < 1000011:
+            chunk = self.sock.recv(65536)
+            self.assertTrue(chunk)
+            data += chunk
+        writer.join()
+
+        self.assertEqual(data, b('').join(buffers))
+
+        # More buffers than one sendmsg() call takes
+        iov_max = connection.IOV_MAX
+        connection.IOV_MAX = 2
+        try:
+            buffers = [b('%i,' % x) for x in range(100)]
+            c.writev(buffers)
+        finally:
+            connection.IOV_MAX = iov_max
+
+        expected = b('').join(buffers)
+        data = b('')
+        while len(data) < len(expected):
+            chunk = self.sock.recv(65536)
+            self.assertTrue(chunk)
+            data += chunk
+        self.assertEqual(data, expected)
+
+        c.close()
+
+    def _assertReader(self, c):
+        f = c.reader()
+        self.assertTrue(c.reader() is f)
+
+        self.sock.sendall(b('GET / HTTP/1.1\r\n'
+                            'Content-Length: 40000\r\n\r\n'))
+        self.assertEqual(f.readline(), b('GET / HTTP/1.1\r\n'))
+        self.assertEqual(f.readline(8), b('Content-'))
+        self.assertEqual(f.readline(), b('Length: 40000\r\n'))
+
+        # Bytes the reader buffered count as pending
+        self.assertTrue(f.pending())
+        self.assertTrue(c.has_pending())
+        self.assertEqual(f.readline(), b('\r\n'))
+        self.assertEqual(f.pending(), 0)
+        self.assertTrue(not c.has_pending())
+
+        # A body larger than the buffer
+        body = b('0123456789') * 4000
+        sender = threading.Thread(target=self.sock.sendall, args=(body,))
+        sender.start()
+        self.assertEqual(f.read(len(body)), body)
+        sender.join()
+
+        self.sock.sendall(b('last line\npartial'))
+        self.sock.close()
+        self.assertEqual(list(f), [b('last line\n'), b('partial')])
+        self.assertEqual(f.read(), b(''))
+
+        c.close()
+
+    def testReader(self):
+        c = connection.Connection(*(self.server.active_queue.get(timeout=10)))
+        self._assertReader(c)
+
+    def testNonBlockingReader(self):
+        c = connection.Connection(*(self.server.active_queue.get(timeout=10)))
+        c.setblocking(False)
+        self._assertReader(c)
+
+class SecureConnectionTest(unittest.TestCase):
+    def setUp(self):
+        global SERVER_PORT_START
+
+        if not HAS_SSL:
+            self.skipTest("ssl module not available")
+
+        SERVER_PORT_START += 1
+        self.starttuple = ('127.0.0.1', SERVER_PORT_START)
+
+        self.server = Rocket(self.starttuple + (PRIV_KEY_FILE, PUB_KEY_FILE),
+                             "fs",
+                             min_threads=0)
+        self.server.start(background=True)
+
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.settimeout(SOCKET_TIMEOUT)
+        self.sock.connect(self.starttuple)
+
+    def tearDown(self):
+        self.sock.close()
+        self.server.stop()
+
+    def testHandshake(self):
+        c = connection.Connection(*(self.server.active_queue.get(timeout=10)))
+
+        self.assertTrue(c.needs_handshake)
+
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)
+        context.check_hostname = False
+        context.verify_mode = ssl.CERT_NONE
+        self.sock = context.wrap_socket(self.sock, do_handshake_on_connect=False)
+
+        # The client has to be handshaking at the same time as the server.
+        import threading
+        t = threading.Thread(target=self.sock.do_handshake)
+        t.start()
+        c.handshake()
+        t.join()
+
+        self.assertTrue(not c.needs_handshake)
+        self.assertTrue(c.ssl)
+
+        SENT_DATA = b("this is a test")
+        self.sock.send(SENT_DATA)
+
+        self.assertEqual(c.recv(len(SENT_DATA)), SENT_DATA)
+
+        self.sock.send(b("one line\nand the next\n"))
+        f = c.reader()
+        self.assertEqual(f.readline(), b("one line\n"))
+        self.assertTrue(c.has_pending())
+        self.assertEqual(f.readline(), b("and the next\n"))
+
+        c.close()
+
+    def testHandshakeWithPlainHTTP(self):
+        c = connection.Connection(*(self.server.active_queue.get(timeout=10)))
+
+        self.sock.send(b("GET / HTTP/1.1\r\n\r\n"))
+        c.handshake()
+
+        # The connection falls back to plain text so the Worker can respond.
+        self.assertTrue(not c.ssl)
+        self.assertTrue(c.secure)
+
+        SENT_DATA = b("HTTP/1.1 400 Bad Request\r\n\r\n")
+        c.sendall(SENT_DATA)
+
+        self.assertEqual(self.sock.recv(len(SENT_DATA)), SENT_DATA)
+
+        c.close()
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+
+# This file is part of the Rocket Web Server
+# Copyright (c) 2012 Timothy Farrell
+#
+# See the included LICENSE.txt file for licensing details.
+
+# Import System Modules
+import os
+import socket
+import unittest
+
+# Import Custom Modules
+from rocket import Rocket, SOCKET_TIMEOUT, b
+
+# Constants
+SERVER_PORT_START = 47450
+
+# Define Tests
+class FileSystemWorkerTest(unittest.TestCase):
+    def setUp(self):
+        global SERVER_PORT_START
+
+        SERVER_PORT_START += 1
+        self.starttuple = ('127.0.0.1', SERVER_PORT_START)
+        self.server = Rocket(self.starttuple,
+                             'fs',
+                             {'document_root': os.path.dirname(__file__),
+                              'display_index': False},
+                             min_threads=1,
+                             handle_signals=False)
+        self.server.start(background=True)
+
+    def tearDown(self):
+        self.server.stop()
+
+    def _request(self, data):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.settimeout(SOCKET_TIMEOUT)
+        sock.connect(self.starttuple)
+        try:
+            sock.sendall(data)
+            data = b('')
+            chunk = sock.recv(4096)
+            while chunk:
+                data += chunk
+                chunk = sock.recv(4096)
+            return data
+        finally:
+            sock.close()
+
+    def testServeFile(self):
+        data = self._request(b('GET /test_fs.py HTTP/1.0\r\n\r\n'))
+
+        self.assertTrue(data.startswith(b('HTTP/1.1 200 OK\r\n')))
+        head, body = data.split(b('\r\n\r\n'), 1)
+        f = open(__file__.replace('.pyc', '.py'), 'rb')
+        try:
+            self.assertEqual(body, f.read())
+        finally:
+            f.close()
+
+    def testBadHeaders(self):
+        # A bad request head gets one response, not a second 500
+        for head in (b('No colon\r\n\r\n'), b('X: ') + b('a') * 70000 + b('\r\n\r\n')):
+            data = self._request(b('GET / HTTP/1.1\r\n') + head)
+
+            self.assertEqual(data.count(b('HTTP/1.1 ')), 1, msg=repr(data))
+            self.assertTrue(data.startswith(b('HTTP/1.1 4')))
+
+if __name__ == '__main__':
+    unittest.main()
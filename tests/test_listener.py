@@ -23,7 +23,7 @@ except ImportError:
     from Queue import Queue
 
 # Import Custom Modules
-from rocket import listener
+from rocket import listener, threadpool, b
 
 # Constants
 SERVER_PORT = 43452
@@ -114,6 +114,203 @@ class ListenerTest(unittest.TestCase):
 
         self.assertEqual(self.listener.active_queue.qsize(), 1)
 
+    def testListenBurst(self):
+        self.testReady() # create Listener
+        self.listener.start()
+
+        socks = list()
+        for x in range(5):
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            sock.settimeout(15)
+            sock.connect(self.interface)
+            socks.append(sock)
+
+        self._waitForEqual(self.listener.active_queue.qsize, 5)
+
+        self.assertEqual(self.listener.active_queue.qsize(), 5)
+
+        for sock in socks:
+            sock.close()
+
+    def testDeferAccept(self):
+        monitor_queue = Queue()
+        self.listener = listener.Listener(self.interface,
+                                          5,
+                                          self.active_queue,
+                                          monitor_queue = monitor_queue)
+
+        # Both clients wait in the backlog until the listener starts so that
+        # the busy one's request has arrived by the time it is accepted.
+        idle = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        idle.settimeout(15)
+        idle.connect(self.interface)
+
+        busy = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        busy.settimeout(15)
+        busy.connect(self.interface)
+        busy.sendall(b('GET / HTTP/1.0\r\n\r\n'))
+        time.sleep(0.1)
+
+        self.listener.start()
+
+        self._waitForEqual(lambda: (self.active_queue.qsize(),
+                                    monitor_queue.qsize()), (1, 1))
+
+        self.assertEqual(self.active_queue.qsize(), 1)
+        self.assertEqual(monitor_queue.qsize(), 1)
+
+        conn = monitor_queue.get()
+        self.assertEqual(conn.client_port, idle.getsockname()[1])
+        conn.close()
+
+        idle.close()
+        busy.close()
+
+    def testAcceptor(self):
+        self.active_queue = threadpool.ActiveQueue()
+        self.testReady() # create Listener
+
+        acceptor = listener.Acceptor([self.listener], self.active_queue)
+        acceptor.start()
+
+        # Starting queues the acceptor for the first leader
+        self.assertTrue(self.active_queue.get(timeout=5) is acceptor)
+
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.settimeout(15)
+        sock.connect(self.interface)
+
+        (conn, addr), port, secure = acceptor.lead()
+        self.assertEqual(addr[1], sock.getsockname()[1])
+        self.assertEqual(port, self.interface[1])
+
+        # The leader promotes the next Worker before returning
+        self.assertTrue(self.active_queue.get(timeout=5) is acceptor)
+
+        # Something queued with no idle Worker to take it wakes the leader
+        t = threading.Timer(0.2, self.active_queue.put, ('work',))
+        t.start()
+        start = time.time()
+        self.assertTrue(acceptor.lead() is None)
+        self.assertTrue(time.time() - start < 5)
+        t.join()
+
+        self.assertEqual(self.active_queue.get(timeout=5), 'work')
+        self.assertTrue(self.active_queue.get(timeout=5) is acceptor)
+
+        # Stopping wakes the leader, which drops the acceptor
+        t = threading.Timer(0.2, acceptor.stop)
+        t.start()
+        self.assertTrue(acceptor.lead() is None)
+        t.join()
+        self.assertTrue(self.active_queue.empty())
+
+        acceptor.close()
+        conn.close()
+        sock.close()
+
+    def testJoinWakesListener(self):
+        self.testReady() # create Listener
+        self.listener.start()
+
+        self.assertTrue(self.listener.isAlive())
+
+        start = time.time()
+        self.listener.join()
+
+        self.assertTrue(not self.listener.isAlive())
+        self.assertTrue(time.time() - start < 0.5,
+                        msg="Listener took too long to notice it should stop.")
+
+    def testSlowHandshakeDoesNotBlockAccept(self):
+        if not self.has_ssl:
+            print("ssl module not available")
+            return
+
+        self.testReady() # create Listener
+        self.sec_listener.start()
+
+        secure_addr = self.secure_interface[:2]
+
+        # A client that connects but never starts the TLS handshake
+        slow = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        slow.settimeout(15)
+        slow.connect(secure_addr)
+
+        fast = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        fast.settimeout(15)
+        fast.connect(secure_addr)
+
+        self._waitForEqual(self.active_queue.qsize, 2)
+
+        self.assertEqual(self.active_queue.qsize(), 2)
+
+        for x in range(2):
+            (sock, addr), port, secure = self.active_queue.get()
+            self.assertTrue(secure)
+            self.assertTrue(isinstance(sock, ssl.SSLSocket))
+            sock.close()
+
+        slow.close()
+        fast.close()
+
+    def testSSLContext(self):
+        if not self.has_ssl:
+            print("ssl module not available")
+            return
+
+        self.sec_listener = listener.Listener(self.secure_interface,
+                                              5,
+                                              self.active_queue,
+                                              dict(minimum_version='TLSv1_2',
+                                                   alpn_protocols=['http/1.1']))
+
+        self.assertTrue(self.sec_listener.ready)
+        self.assertTrue(isinstance(self.sec_listener.ssl_context, ssl.SSLContext))
+        self.assertEqual(self.sec_listener.ssl_context.minimum_version,
+                         ssl.TLSVersion.TLSv1_2)
+
+    def testSessionResumption(self):
+        if not self.has_ssl:
+            print("ssl module not available")
+            return
+
+        from rocket.connection import Connection
+
+        self.testReady() # create Listener
+        self.sec_listener.start()
+
+        client_context = ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)
+        client_context.check_hostname = False
+        client_context.verify_mode = ssl.CERT_NONE
+
+        session = None
+        for x in range(2):
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            sock.settimeout(15)
+            sock.connect(self.secure_interface[:2])
+            sock = client_context.wrap_socket(sock,
+                                              session=session,
+                                              do_handshake_on_connect=False)
+
+            conn = Connection(*self.active_queue.get(timeout=15))
+            t = threading.Thread(target=conn.handshake)
+            t.start()
+            sock.do_handshake()
+            t.join()
+
+            # Reading lets the client pick up the server's session ticket.
+            conn.sendall(b('x'))
+            sock.recv(1)
+
+            session = sock.session
+            resumed = sock.session_reused
+
+            conn.close()
+            sock.close()
+
+        self.assertTrue(resumed, msg="TLS session was not resumed.")
+
     def testWrapSocket(self):
         if not self.has_ssl:
             print("ssl module not available")
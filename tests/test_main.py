@@ -0,0 +1,350 @@
+# -*- coding: utf-8 -*-
+
+# This file is part of the Rocket Web Server
+# Copyright (c) 2012 Timothy Farrell
+#
+# See the included LICENSE.txt file for licensing details.
+
+# Import System Modules
+import os
+import time
+import socket
+import unittest
+import threading
+from wsgiref.simple_server import demo_app
+
+# Import Custom Modules
+from rocket import Rocket, SOCKET_TIMEOUT, b
+
+# Constants
+SERVER_PORT_START = 46450
+
+# Define Tests
+class RocketTest(unittest.TestCase):
+    def setUp(self):
+        global SERVER_PORT_START
+
+        SERVER_PORT_START += 1
+        self.starttuple = ('127.0.0.1', SERVER_PORT_START)
+        self.server = None
+
+    def _waitForChildren(self, count, exclude=None):
+        attempts = 40
+        while attempts > 0:
+            children = list(self.server._children.keys())
+            if len(children) == count and exclude not in children:
+                return True
+            time.sleep(0.25)
+            attempts -= 1
+        return False
+
+    def _request(self):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.settimeout(SOCKET_TIMEOUT)
+        sock.connect(self.starttuple)
+        try:
+            sock.sendall(b('GET / HTTP/1.0\r\n\r\n'))
+            data = b('')
+            chunk = sock.recv(4096)
+            while chunk:
+                data += chunk
+                chunk = sock.recv(4096)
+            return data
+        finally:
+            sock.close()
+
+    def testPrefork(self):
+        if not hasattr(os, 'fork'):
+            self.skipTest("This platform cannot fork")
+
+        self.server = Rocket(self.starttuple,
+                             'wsgi',
+                             {'wsgi_app': demo_app},
+                             min_threads=1,
+                             handle_signals=False,
+                             processes=2)
+        self.server.start(background=True)
+
+        self.assertTrue(self._waitForChildren(2))
+
+        for x in range(4):
+            data = self._request()
+            self.assertTrue(data.startswith(b('HTTP/1.1 200 OK')))
+            # demo_app echoes the environ
+            self.assertTrue(b("wsgi.multiprocess = True") in data)
+
+    def testPreforkRestartsDeadChildren(self):
+        if not hasattr(os, 'fork'):
+            self.skipTest("This platform cannot fork")
+
+        import signal
+
+        self.server = Rocket(self.starttuple,
+                             'wsgi',
+                             {'wsgi_app': demo_app},
+                             min_threads=1,
+                             handle_signals=False,
+                             processes=2)
+        self.server.start(background=True)
+
+        self.assertTrue(self._waitForChildren(2))
+
+        victim = list(self.server._children.keys())[0]
+        os.kill(victim, signal.SIGKILL)
+
+        self.assertTrue(self._waitForChildren(2, exclude=victim),
+                        msg="Supervisor did not replace a dead child.")
+        self.assertTrue(self._request().startswith(b('HTTP/1.1 200 OK')))
+
+    def _keepAliveRequests(self, sock, count):
+        for x in range(count):
+            # Give the worker time to park the connection in the Monitor.
+            time.sleep(0.1)
+
+            start = time.time()
+            sock.sendall(b('GET / HTTP/1.1\r\nHost: localhost\r\n\r\n'))
+            data = b('')
+            while not data.endswith(b('OK')):
+                chunk = sock.recv(4096)
+                self.assertTrue(chunk, msg="Server closed the connection.")
+                data += chunk
+            elapsed = time.time() - start
+
+            self.assertTrue(data.startswith(b('HTTP/1.1 200 OK')))
+            self.assertTrue(elapsed < 0.5,
+                            msg="Request %i took %.3fs" % (x + 1, elapsed))
+
+    def _startKeepAliveServer(self, **kwargs):
+        def app(environ, start_response):
+            start_response('200 OK', [('Content-Type', 'text/plain'),
+                                      ('Content-Length', '2')])
+            return [b('OK')]
+
+        self.server = Rocket(self.starttuple,
+                             'wsgi',
+                             {'wsgi_app': app},
+                             min_threads=1,
+                             handle_signals=False,
+                             **kwargs)
+        self.server.start(background=True)
+
+    def testKeepAliveLatency(self):
+        self._startKeepAliveServer()
+
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.settimeout(SOCKET_TIMEOUT)
+        sock.connect(self.starttuple)
+        try:
+            self._keepAliveRequests(sock, 2)
+        finally:
+            sock.close()
+
+    def testMonitorShards(self):
+        self._startKeepAliveServer(monitors=3, defer_accept=True)
+
+        self.assertEqual(len(self.server._monitors), 3)
+
+        socks = list()
+        try:
+            for x in range(4):
+                sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+                sock.settimeout(SOCKET_TIMEOUT)
+                sock.connect(self.starttuple)
+                socks.append(sock)
+
+            for sock in socks:
+                self._keepAliveRequests(sock, 2)
+        finally:
+            for sock in socks:
+                sock.close()
+
+    def testLeaderFollower(self):
+        self._startKeepAliveServer(leader_follower=True)
+
+        for l in self.server.listeners:
+            self.assertTrue(not l.isAlive())
+
+        # New connections and keep-alive connections coming back from the
+        # Monitor are both served.
+        for x in range(3):
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            sock.settimeout(SOCKET_TIMEOUT)
+            sock.connect(self.starttuple)
+            try:
+                self._keepAliveRequests(sock, 2)
+            finally:
+                sock.close()
+
+    def _startBlockingServer(self, **kwargs):
+        self.release = threading.Event()
+
+        def app(environ, start_response):
+            if environ['PATH_INFO'].startswith('/slow'):
+                self.release.wait(SOCKET_TIMEOUT)
+            start_response('200 OK', [('Content-Type', 'text/plain'),
+                                      ('Content-Length', '2')])
+            return [b('OK')]
+
+        self.server = Rocket(self.starttuple,
+                             'wsgi',
+                             {'wsgi_app': app},
+                             handle_signals=False,
+                             **kwargs)
+        self.server.start(background=True)
+
+    def _send(self, path):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.settimeout(SOCKET_TIMEOUT)
+        sock.connect(self.starttuple)
+        sock.sendall(b('GET %s HTTP/1.0\r\n\r\n' % path))
+        return sock
+
+    def _receive(self, sock):
+        data = b('')
+        chunk = sock.recv(4096)
+        while chunk:
+            data += chunk
+            chunk = sock.recv(4096)
+        sock.close()
+        return data
+
+    def _assertNotStarved(self, path):
+        start = time.time()
+        data = self._receive(self._send(path))
+        self.assertTrue(data.startswith(b('HTTP/1.1 200 OK')))
+        self.assertTrue(time.time() - start < 1,
+                        msg="%s waited behind the slow requests." % path)
+
+    def testPrefixPool(self):
+        self._startBlockingServer(min_threads=1,
+                                  max_threads=2,
+                                  pools=[dict(prefixes=['/slow'],
+                                              min_threads=1,
+                                              max_threads=2)])
+
+        slow = [self._send('/slow') for x in range(4)]
+        time.sleep(0.5)
+
+        try:
+            self._assertNotStarved('/')
+        finally:
+            self.release.set()
+
+        for sock in slow:
+            self.assertTrue(self._receive(sock).startswith(b('HTTP/1.1 200')))
+
+    def testReservedThreads(self):
+        self._startBlockingServer(min_threads=1,
+                                  max_threads=3,
+                                  reserved_threads=1,
+                                  priority=['/health'])
+
+        slow = [self._send('/slow') for x in range(4)]
+        time.sleep(0.5)
+
+        try:
+            self._assertNotStarved('/health')
+        finally:
+            self.release.set()
+
+        for sock in slow:
+            self.assertTrue(self._receive(sock).startswith(b('HTTP/1.1 200')))
+
+    def testOverloadShedding(self):
+        self._startBlockingServer(min_threads=1,
+                                  max_threads=1,
+                                  max_queued=1)
+
+        slow = self._send('/slow')
+        time.sleep(0.5)
+        queued = self._send('/')
+        time.sleep(0.2)
+
+        try:
+            start = time.time()
+            data = self._receive(self._send('/'))
+            self.assertTrue(data.startswith(b('HTTP/1.1 503')))
+            self.assertTrue(time.time() - start < 1)
+        finally:
+            self.release.set()
+
+        for sock in (slow, queued):
+            self.assertTrue(self._receive(sock).startswith(b('HTTP/1.1 200')))
+
+        stats = self.server.stats()[0]
+        self.assertEqual(stats['rejected'], 1)
+        self.assertEqual(stats['max_threads'], 1)
+
+    def testPipelining(self):
+        def app(environ, start_response):
+            body = b(environ['PATH_INFO'])
+            if body != b('/skip'):
+                length = int(environ.get('CONTENT_LENGTH', 0))
+                body += environ['wsgi.input'].read(length)
+            start_response('200 OK', [('Content-Type', 'text/plain'),
+                                      ('Content-Length', str(len(body)))])
+            return [body]
+
+        self.server = Rocket(self.starttuple,
+                             'wsgi',
+                             {'wsgi_app': app},
+                             min_threads=1,
+                             handle_signals=False)
+        self.server.start(background=True)
+
+        # Every request goes out in one packet.  The server must not lose the
+        # ones its reader buffered while reading the first.
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.settimeout(SOCKET_TIMEOUT)
+        sock.connect(self.starttuple)
+        sock.sendall(b('GET /a HTTP/1.1\r\nHost: localhost\r\n\r\n'
+                       'POST /b HTTP/1.1\r\nHost: localhost\r\n'
+                       'Content-Length: 4\r\n\r\nbody'
+                       'POST /d HTTP/1.1\r\nHost: localhost\r\n'
+                       'Transfer-Encoding: chunked\r\n\r\n'
+                       '3\r\none\r\n0\r\nX-Trailer: 1\r\n\r\n'
+                       'POST /skip HTTP/1.1\r\nHost: localhost\r\n'
+                       'Content-Length: 7\r\n\r\nignored'
+                       'GET /c HTTP/1.1\r\nHost: localhost\r\n'
+                       'Connection: close\r\n\r\n'))
+        data = self._receive(sock)
+
+        bodies = [r.split(b('\r\n\r\n'), 1)[1]
+                  for r in data.split(b('HTTP/1.1 200 OK'))[1:]]
+        self.assertEqual(bodies, [b('/a'), b('/bbody'), b('/done'),
+                                  b('/skip'), b('/c')])
+
+    def testBodyTooLarge(self):
+        def app(environ, start_response):
+            body = environ['wsgi.input'].read()
+            start_response('200 OK', [('Content-Type', 'text/plain'),
+                                      ('Content-Length', str(len(body)))])
+            return [body]
+
+        self.server = Rocket(self.starttuple,
+                             'wsgi',
+                             {'wsgi_app': app},
+                             min_threads=1,
+                             handle_signals=False,
+                             max_body_size=8)
+        self.server.start(background=True)
+
+        for request in (b('POST / HTTP/1.1\r\nHost: localhost\r\n'
+                          'Content-Length: 16\r\n\r\n') + b('x') * 16,
+                        b('POST / HTTP/1.1\r\nHost: localhost\r\n'
+                          'Transfer-Encoding: chunked\r\n\r\n'
+                          '4\r\nxxxx\r\n4\r\nxxxx\r\n4\r\nxxxx\r\n0\r\n\r\n')):
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            sock.settimeout(SOCKET_TIMEOUT)
+            sock.connect(self.starttuple)
+            sock.sendall(request)
+            data = self._receive(sock)
+            self.assertTrue(data.startswith(b('HTTP/1.1 413')), msg=repr(data))
+
+    def tearDown(self):
+        if self.server is not None:
+            self.server.stop()
+            self.assertEqual(len(self.server._children), 0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -111,6 +111,161 @@ class MonitorTest(unittest.TestCase):
         conn2 = self.active_queue.get()
         self.assertTrue(conn is conn2)
 
+    def _startMonitor(self):
+        self.testNotActive() # create self.monitor
+        self.monitor.start()
+        self._waitForEqual(lambda: self.monitor.active, True)
+
+    def _parkSocketPairs(self, count, idle_timeout=None):
+        pairs = list()
+        for x in range(count):
+            server, client = socket.socketpair()
+            conn = connection.Connection((server, ('127.0.0.1', x)),
+                                         SERVER_PORT)
+            conn.idle_timeout = idle_timeout
+            self.monitor_queue.put(conn)
+            pairs.append((conn, client))
+        return pairs
+
+    def testManyConnections(self):
+        # More than FD_SETSIZE (1024) descriptors would break select.select()
+        count = 1100
+
+        try:
+            import resource
+            if resource.getrlimit(resource.RLIMIT_NOFILE)[0] < count * 3:
+                self.skipTest("Not enough file descriptors available")
+        except ImportError:
+            pass
+
+        self._startMonitor()
+
+        pairs = self._parkSocketPairs(count)
+        try:
+            self._waitForEqual(lambda: len(self.monitor.connections), count)
+            self.assertEqual(len(self.monitor.connections), count)
+
+            conn, client = pairs[-1]
+            client.send(b("test data"))
+
+            self.assertTrue(self.active_queue.get(timeout=5) is conn)
+            self.assertEqual(len(self.monitor.connections), count - 1)
+        finally:
+            self.monitor.stop()
+            self.monitor.join(5)
+            for conn, client in pairs:
+                conn.close()
+                client.close()
+
+    def testStaleConnection(self):
+        self.timeout = 1
+        self._startMonitor()
+
+        conn, client = self._parkSocketPairs(1)[0]
+
+        # The monitor closes the connection once the timeout passes
+        client.settimeout(15)
+        self.assertEqual(client.recv(1), b(''))
+        self.assertEqual(len(self.monitor.connections), 0)
+        self.assertEqual(self.active_queue.qsize(), 0)
+
+        client.close()
+
+    def testExpire(self):
+        self.testNotActive() # create self.monitor
+
+        pairs = self._parkSocketPairs(2)
+        (short, a), (default, b) = pairs
+        short.idle_timeout = 1
+
+        now = time.time()
+        for conn, client in pairs:
+            self.monitor.park(conn)
+
+        self.assertEqual(self.monitor.expire(now), [])
+        self.assertEqual(self.monitor.expire(now + 2), [short])
+
+        # A connection that comes back gets a fresh deadline.  The entry for
+        # its previous visit must not expire it.
+        del self.monitor.connections[default]
+        self.monitor.park(default)
+        self.assertEqual(len(self.monitor.deadlines), 2)
+
+        self.assertEqual(self.monitor.expire(now + self.timeout + 5),
+                         [default])
+        self.assertEqual(self.monitor.deadlines, [])
+
+        for conn, client in pairs:
+            conn.close()
+            client.close()
+
+    def testIdleTimeout(self):
+        self.timeout = 600
+        self._startMonitor()
+
+        conn, client = self._parkSocketPairs(1, idle_timeout=1)[0]
+
+        client.settimeout(15)
+        self.assertEqual(client.recv(1), b(''))
+        self.assertEqual(len(self.monitor.connections), 0)
+
+        client.close()
+
+    def testShardedMonitorQueue(self):
+        queue = monitor.ShardedMonitorQueue(3)
+
+        self.assertEqual(len(queue.shards), 3)
+        self.assertTrue(queue.empty())
+
+        pairs = list()
+        for x in range(6):
+            pairs.append(socket.socketpair())
+            queue.put(pairs[-1][0])
+
+        self.assertEqual(queue.qsize(), 6)
+        self.assertTrue(not queue.empty())
+
+        # Each socket lands in the shard picked by its file descriptor
+        for q in queue.shards:
+            while not q.empty():
+                sock = q.get()
+                self.assertTrue(queue.shards[sock.fileno() % 3] is q)
+
+        for a, b in pairs:
+            a.close()
+            b.close()
+
+    def testParkingWakesMonitor(self):
+        self.monitor_queue = monitor.MonitorQueue()
+        self._startMonitor()
+
+        start = time.time()
+        conn, client = self._parkSocketPairs(1)[0]
+
+        # Without a wakeup the monitor would not look at its queue again until
+        # select() times out.
+        while not self.monitor.connections and time.time() - start < 5:
+            time.sleep(0.01)
+        self.assertTrue(time.time() - start < 0.5,
+                        msg="Monitor took too long to notice a new connection.")
+
+        client.send(b("test data"))
+        self.assertTrue(self.active_queue.get(timeout=5) is conn)
+
+        conn.close()
+        client.close()
+
+    def testStopWakesMonitor(self):
+        self._startMonitor()
+
+        start = time.time()
+        self.monitor.stop()
+        self.monitor.join(5)
+
+        self.assertTrue(not self.monitor.is_alive())
+        self.assertTrue(time.time() - start < 0.5,
+                        msg="Monitor took too long to notice it should stop.")
+
     def tearDown(self):
         try:
             self.listener.ready = False
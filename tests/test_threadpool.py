@@ -7,21 +7,38 @@
 
 # Import System Modules
 import time
+import socket
 import unittest
+import threading
 try:
-    from queue import Queue
+    from queue import Queue, Empty
 except ImportError:
-    from Queue import Queue
+    from Queue import Queue, Empty
 try:
     from functools import reduce
 except ImportError:
     pass
 
 # Import Custom Modules
-from rocket import threadpool, worker
+from rocket import threadpool, worker, b
 
 # Constants
 
+class SleepyWorker(threading.Thread):
+    """A Worker that holds on to each connection until release is set."""
+    release = threading.Event()
+
+    def __init__(self, app_info, active_queue, monitor_queue):
+        threading.Thread.__init__(self)
+        self.active_queue = active_queue
+
+    def run(self):
+        while True:
+            conn = self.active_queue.get()
+            if conn is None:
+                return
+            self.release.wait(15)
+
 # Define Tests
 class ThreadPoolTest(unittest.TestCase):
     def setUp(self):
@@ -146,6 +163,274 @@ class ThreadPoolTest(unittest.TestCase):
 
         self.assertTrue(self.min_threads < len(self.tp.threads) < self.max_threads + 1)
 
+    def testThreadPoolResizer(self):
+        self.tp.start()
+        self.tp.grow(1)
+
+        self.assertEqual(len(self.tp.threads), self.min_threads + 1)
+
+        self.tp.start_resizer(0.1)
+
+        # The resizer trims the idle extra thread on its own.
+        attempts = 50
+        while len(self.tp.threads) > self.min_threads and attempts:
+            time.sleep(0.1)
+            attempts -= 1
+
+        self.assertEqual(len(self.tp.threads), self.min_threads)
+
+        self.tp.stop()
+
+        self.assertTrue(self.tp.resizer is None)
+        self.assertEqual(len(self.tp.threads), 0)
+
+    def _activeQueuePool(self, worker_class):
+        self.tp.stop()
+        self.active_queue = threadpool.ActiveQueue()
+        self.tp = threadpool.ThreadPool(worker_class,
+                                        dict(),
+                                        self.active_queue,
+                                        self.monitor_queue,
+                                        self.min_threads,
+                                        self.max_threads)
+
+    def testActiveQueue(self):
+        queue = threadpool.ActiveQueue()
+
+        t = threading.Thread(target=queue.get)
+        t.start()
+
+        attempts = 50
+        while queue.waiting == 0 and attempts:
+            time.sleep(0.01)
+            attempts -= 1
+        self.assertEqual(queue.waiting, 1)
+
+        queue.put(1)
+        t.join(5)
+        self.assertEqual(queue.waiting, 0)
+
+        queue.put(2)
+        time.sleep(0.1)
+        self.assertEqual(queue.get(), 2)
+        self.assertTrue(queue.wait_time > 0.1 * threadpool.WAIT_ALPHA / 2)
+
+        # Death threats don't count as connections waiting for a Worker
+        wait_time = queue.wait_time
+        queue.put(None)
+        time.sleep(0.1)
+        self.assertTrue(queue.get() is None)
+        self.assertEqual(queue.wait_time, wait_time)
+
+    def testActiveQueueWakesLastIdle(self):
+        queue = threadpool.ActiveQueue()
+        got = dict()
+
+        def get(n):
+            got[n] = queue.get()
+
+        # Workers 0, 1 and 2 go idle in that order
+        threads = list()
+        for n in range(3):
+            threads.append(threading.Thread(target=get, args=(n,)))
+            threads[n].start()
+            attempts = 50
+            while queue.waiting < n + 1 and attempts:
+                time.sleep(0.01)
+                attempts -= 1
+            self.assertEqual(queue.waiting, n + 1)
+
+        # A connection goes to the most recently idle Worker...
+        queue.put('conn')
+        threads[2].join(5)
+        self.assertEqual(got, {2: 'conn'})
+        self.assertEqual(queue.waiting, 2)
+        self.assertEqual(queue.busy, 1)
+
+        # ...and a death threat to the one idle the longest.
+        queue.put(None)
+        threads[0].join(5)
+        self.assertEqual(got, {2: 'conn', 0: None})
+        self.assertEqual(queue.busy, 1)
+
+        queue.put('last')
+        threads[1].join(5)
+        self.assertEqual(got[1], 'last')
+        self.assertEqual(queue.waiting, 0)
+        self.assertEqual(queue.qsize(), 0)
+
+        self.assertEqual(queue.busy, 2)
+
+        self.assertRaises(Empty, queue.get, timeout=0.05)
+        self.assertEqual(queue.waiting, 0)
+
+    def testActiveQueueRegularLane(self):
+        queue = threadpool.ActiveQueue()
+        queue.limit = 1
+
+        # This thread runs the one regular request allowed at a time
+        self.assertTrue(queue.claim())
+        self.assertTrue(queue.claim())
+
+        got = list()
+        t = threading.Thread(target=lambda: got.append(queue.get(timeout=5)))
+        t.start()
+
+        # Other regular requests wait even though a Worker is idle...
+        queue.put_regular('regular')
+        time.sleep(0.1)
+        self.assertEqual(got, [])
+        self.assertEqual(queue.qsize(), 0)
+
+        # ...but priority traffic doesn't.
+        queue.put('priority')
+        t.join(5)
+        self.assertEqual(got, ['priority'])
+
+        # No other thread may run a regular request while we hold the slot
+        claimed = list()
+        t = threading.Thread(target=lambda: claimed.append(queue.claim()))
+        t.start()
+        t.join(5)
+        self.assertEqual(claimed, [False])
+
+        # Asking for more work frees our regular slot
+        self.assertEqual(queue.get(timeout=5), 'regular')
+        self.assertEqual(queue.busy, 2)
+
+    def _connection(self):
+        server, client = socket.socketpair()
+        client.settimeout(5)
+        return ((server, ('127.0.0.1', 0)), 80, False), client
+
+    def _assertShed(self, client):
+        data = client.recv(4096)
+        self.assertTrue(data.startswith(b('HTTP/1.1 503 Service Unavailable')))
+        self.assertTrue(b('Retry-After: 1') in data)
+        client.close()
+
+    def testActiveQueueMaxsize(self):
+        queue = threadpool.ActiveQueue(maxsize=1)
+
+        first, client1 = self._connection()
+        second, client2 = self._connection()
+        queue.put(first)
+        queue.put(second)
+
+        self._assertShed(client2)
+        self.assertEqual(queue.qsize(), 1)
+        self.assertEqual(queue.stats()['rejected'], 1)
+
+        # Death threats are never turned away
+        queue.put(None)
+        self.assertEqual(queue.qsize(), 2)
+
+        self.assertTrue(queue.get() is first)
+        first[0][0].close()
+        client1.close()
+
+    def testActiveQueueMaxAge(self):
+        queue = threadpool.ActiveQueue(max_age=0.1)
+
+        old, client1 = self._connection()
+        queue.put(old)
+        time.sleep(0.2)
+
+        new, client2 = self._connection()
+        queue.put(new)
+
+        self.assertTrue(queue.get(timeout=1) is new)
+        self._assertShed(client1)
+
+        stats = queue.stats()
+        self.assertEqual(stats['expired'], 1)
+        self.assertEqual(stats['dispatched'], 1)
+
+        new[0][0].close()
+        client2.close()
+
+    def testActiveQueueLifo(self):
+        queue = threadpool.ActiveQueue(lifo=True)
+        queue.overload_age = 0.05
+
+        for x in range(3):
+            queue.put(x)
+
+        # Not overloaded yet
+        self.assertEqual(queue.get(), 0)
+
+        time.sleep(0.1)
+        self.assertEqual(queue.get(), 2)
+        self.assertEqual(queue.get(), 1)
+        self.assertEqual(queue.stats()['lifo_dispatched'], 2)
+
+    def testRouter(self):
+        default = threadpool.ThreadPool(worker.Worker, dict(), Queue(), None)
+        api = threadpool.ThreadPool(worker.Worker, dict(), Queue(), None,
+                                    priority=['/api/health'])
+        reports = threadpool.ThreadPool(worker.Worker, dict(), Queue(), None)
+
+        router = threadpool.Router(default)
+        router.add(api, ports=[8001], prefixes=['/api'])
+        router.add(reports, prefixes=['/api/reports', '/reports'])
+
+        self.assertTrue(router.route('/', 8000) is default)
+        self.assertTrue(router.route('/', 8001) is api)
+        self.assertTrue(router.route('/api/users', 8000) is api)
+        self.assertTrue(router.route('/api/reports/1', 8001) is reports)
+        self.assertTrue(router.pool_for_port(8001) is api)
+
+        self.assertTrue(api.is_priority('/api/health'))
+        self.assertTrue(not api.is_priority('/api/users'))
+        self.assertTrue(not default.is_priority('/api/health'))
+
+    def testThreadPoolGrowsOnBacklog(self):
+        SleepyWorker.release.clear()
+        self._activeQueuePool(SleepyWorker)
+
+        self.tp.start()
+        # The interval is far longer than the test.  Only the ActiveQueue
+        # telling the pool about the backlog can make it grow.
+        self.tp.start_resizer(600)
+
+        for x in range(self.min_threads + 5):
+            self.active_queue.put(x)
+
+        attempts = 50
+        while self.active_queue.qsize() and attempts:
+            time.sleep(0.1)
+            attempts -= 1
+
+        self.assertEqual(self.active_queue.qsize(), 0)
+        self.assertEqual(len(self.tp.threads), self.min_threads + 5)
+
+        SleepyWorker.release.set()
+
+    def testThreadPoolShrinksAfterDelay(self):
+        self._activeQueuePool(worker.Worker)
+
+        self.tp.start()
+        self.tp.grow(5)
+        self.tp.shrink_delay = 0.2
+
+        attempts = 50
+        while self.active_queue.waiting < self.min_threads + 5 and attempts:
+            time.sleep(0.01)
+            attempts -= 1
+
+        # Low utilization has to last for shrink_delay before the pool shrinks
+        self.tp.dynamic_resize()
+        time.sleep(0.1)
+        self.tp.bring_out_your_dead()
+        self.assertEqual(len(self.tp.threads), self.min_threads + 5)
+
+        time.sleep(0.2)
+        self.tp.dynamic_resize()
+        time.sleep(0.5)
+        self.tp.bring_out_your_dead()
+
+        self.assertEqual(len(self.tp.threads), self.min_threads)
+
     def tearDown(self):
         try:
             self.tp.stop()
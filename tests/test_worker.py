@@ -53,6 +53,8 @@ HEADER_DICT = {
 SENDALL_VALUES = [
     b('''HTTP/1.1 200 OK\nContent-Length: 2\nContent-Type: text/plain\n\nOK\n'''),
     b('''HTTP/1.1 400 Bad Request\nContent-Length: 11\nContent-Type: text/plain\n\nBad Request\n'''),
+    b('''HTTP/1.1 414 Request-URI Too Long\nContent-Length: 20\nContent-Type: text/plain\n\nRequest-URI Too Long\n'''),
+    b('''HTTP/1.1 431 Request Header Fields Too Large\nContent-Length: 31\nContent-Type: text/plain\n\nRequest Header Fields Too Large\n'''),
 ]
 REQUEST_DICT = {
     b('GET / HTTP/1.1'): \
@@ -79,6 +81,14 @@ REQUEST_DICT = {
             method='POST',
             protocol='HTTP/1.0'
         ),
+    b('PATCH /items/1?x=%2F%20 HTTP/1.1'): \
+        dict(path='/items/1',
+            query_string='x=%2F%20',
+            scheme='',
+            host='',
+            method='PATCH',
+            protocol='HTTP/1.1'
+        ),
     b('OPTIONS * HTTP/1.0'): \
         dict(path='*',
             query_string='',
@@ -95,7 +105,9 @@ BAD_REQUESTS = [
     b('GET /dir1/dir2/file1.html?a=1&b=2 HTTP/0.9'), # Bad protocol
     b('GET file1.html HTTP/1.1'), # Bad path
     b('OPTIONS *.* HTTP/1.0'), # Bad path
-    b('REMOVE /dir1/dir2/file1.html?a=1&b=2 HTTP/1.1'), # Bad method
+    b('GE(T /dir1/dir2/file1.html?a=1&b=2 HTTP/1.1'), # Bad method
+    b('GET http://example.com HTTP/1.1'), # Bad path
+    b('GET /dir1/dir2/file1.html?a=1&b=2  HTTP/1.1'), # Bad format
 ]
 
 class FakeConn:
@@ -105,6 +117,11 @@ class FakeConn:
         self.closed = False
         self.ssl = False
         self.secure = False
+        self.needs_handshake = False
+        self.pending = False
+
+    def has_pending(self):
+        return self.pending
 
     def sendall(self, data):
         self.sendData = data
@@ -116,6 +133,18 @@ class FakeConn:
     def close(self):
         self.closed = True
 
+class KeepAliveWorker(worker.Worker):
+    "A Worker that serves each connection's requests without closing it."
+    def __init__(self, *args, **kwargs):
+        worker.Worker.__init__(self, *args, **kwargs)
+        self.served = 0
+
+    def run_app(self, conn):
+        self.served += 1
+        self.closeConnection = False
+        # The second request is the last one the client pipelined.
+        conn.pending = self.served < 2
+
 class FakeVars:
     def __init__(self):
         self.args = list()
@@ -168,6 +197,32 @@ class WorkerTest(unittest.TestCase):
         for header_name in HEADER_DICT.keys():
             self.assertEqual(headers[header_name], HEADER_DICT[header_name])
 
+    def testReadHeadersLimits(self):
+        self.worker.conn = FakeConn()
+        self.worker.max_header_size = 64
+        self.worker.max_headers = 3
+
+        headers = self.worker.read_headers(BytesIO(b('Host: a\r\nX-Custom-Thing:  b \r\n\r\nbody')))
+        self.assertEqual(headers, {'HOST': 'a', 'X_CUSTOM_THING': 'b'})
+
+        for head, status in [(b('X: ') + b('a') * 64 + b('\r\n\r\n'), b('431')),
+                             (b('X: a\r\n') * 4 + b('\r\n'), b('431')),
+                             (b(' folded\r\n\r\n'), b('400')),
+                             (b('No colon\r\n\r\n'), b('400'))]:
+            self.assertRaises(worker.BadRequest,
+                              self.worker.read_headers,
+                              BytesIO(head))
+            self.assertTrue(self.worker.conn.sendData.startswith(b('HTTP/1.1 ') + status))
+
+        self.assertRaises(worker.SocketClosed,
+                          self.worker.read_headers,
+                          BytesIO(b('Host: a\r\n')))
+
+        self.assertRaises(worker.BadRequest,
+                          self.worker.read_request_line,
+                          BytesIO(b('GET /') + b('a') * 64 + b(' HTTP/1.1\r\n')))
+        self.assertTrue(self.worker.conn.sendData.startswith(b('HTTP/1.1 414')))
+
     def testReadRequestLine(self):
         self.worker.conn = FakeConn()
         for reqline, resdict in REQUEST_DICT.items():
@@ -176,6 +231,31 @@ class WorkerTest(unittest.TestCase):
             for key in result:
                 self.assertEqual(result[key], resdict[key])
 
+    def testParseRequestLine(self):
+        for reqline, resdict in REQUEST_DICT.items():
+            self.assertEqual(worker.parse_request_line(reqline), resdict)
+
+        for reqline in BAD_REQUESTS:
+            self.assertEqual(worker.parse_request_line(reqline), None)
+
+    def testResponseHeaders(self):
+        self.assertEqual(worker.status_line('200 OK'), b('HTTP/1.1 200 OK\r\n'))
+        self.assertTrue(worker.status_line('200 OK') is worker.status_line('200 OK'))
+
+        line = worker.date_header()
+        self.assertTrue(line.startswith(b('Date: ')) and line.endswith(b(' GMT\r\n')))
+
+        data, found = worker.encode_headers([('Content-Type', 'text/plain'),
+                                             ('CONTENT-LENGTH', '2')])
+        self.assertEqual(data, b('Content-Type: text/plain\r\n'
+                                 'CONTENT-LENGTH: 2\r\n'))
+        self.assertEqual(found, {'content-length': '2'})
+
+        self.assertRaises(UnicodeError, worker.encode_headers,
+                          [('X-Euro', u'\u20ac')])
+        self.assertRaises(TypeError, worker.encode_headers,
+                          [('Content-Length', 2)])
+
     def testReadRequestLineErrors(self):
         self.worker.conn = FakeConn()
         for reqline in BAD_REQUESTS:
@@ -220,6 +300,7 @@ class WorkerTest(unittest.TestCase):
         # Test Bad Request
         self.assertTrue(m(worker.BadRequest, None, None))
         self.assertEqual(self.worker.closeConnection, True)
+        self.assertTrue(self.worker.conn.closed)
 
     def testHandleError_SocketClosed(self):
         m = self.worker._handleError
@@ -313,6 +394,23 @@ class WorkerTest(unittest.TestCase):
 
         self.assertEqual(conn.sendData, b('HTTP/1.1 500 Server Error\nContent-Length: 12\nContent-Type: text/plain\n\nServer Error\n'))
 
+    def testRun_ParksIdleKeepAliveConnection(self):
+        self.worker = KeepAliveWorker(dict(), self.active_queue, self.monitor_queue)
+        conn = FakeConn()
+        conn.start_time = 0
+
+        self.active_queue.put(conn)
+        self.active_queue.put(None)
+
+        # NOTE: This test may infinite loop instead of fail.
+        self.assertEqual(None, self.worker.run())
+
+        # Both waiting requests were served before the connection was parked
+        self.assertEqual(self.worker.served, 2)
+        self.assertTrue(self.monitor_queue.get_nowait() is conn)
+        self.assertTrue(not conn.closed)
+        self.assertTrue(conn.start_time > 0)
+
     def tearDown(self):
         del self.worker
 
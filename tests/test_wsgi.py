@@ -31,7 +31,7 @@ except ImportError:
 from wsgiref.simple_server import demo_app
 
 # Import Custom Modules
-from rocket import b
+from rocket import b, HTTP_SERVER_SOFTWARE
 from rocket.methods import wsgi
 
 # Constants
@@ -68,12 +68,21 @@ class FakeConn:
         self.server_port = 45454
         self.client_port = 40000
         self.client_addr = "127.0.0.1"
+        self.environ = {'SERVER_PORT': '45454',
+                        'REMOTE_PORT': '40000',
+                        'REMOTE_ADDR': '127.0.0.1',
+                        'wsgi.url_scheme': 'http'}
+        self.writes = []
 
     def sendall(self, data):
         self.sendData = data
         if data.lower().strip().endswith(b("error")):
             raise socket.error
 
+    def writev(self, buffers):
+        self.writes.append(list(buffers))
+        self.sendall(b('').join(buffers))
+
     def makefile(mode="rb", buf_size=1024):
         return StringIO(b('\r\n').join(SAMPLE_HEADERS.splitlines()) + b('\r\n\r\n'))
 
@@ -164,6 +173,12 @@ class WSGIWorkerTest(unittest.TestCase):
                     self.assertTrue(valid.match(env[name]),
                                  msg="%s=\"%s\" does not validate." % (name, env[name]))
 
+        # The connection's variables are copied, not shared
+        env['REMOTE_ADDR'] = '10.0.0.1'
+        self.assertEqual(conn.environ['REMOTE_ADDR'], '127.0.0.1')
+
+        self.assertTrue(wsgi.environ_key('X_CUSTOM') is wsgi.environ_key('X_CUSTOM'))
+
     def testStartResponse(self):
         """The start_response parameter is a callable accepting two required
         positional arguments, and one optional argument. For the sake of
@@ -240,6 +255,7 @@ class WSGIWorkerTest(unittest.TestCase):
         for data in output:
             if data:
                 self.worker.write(data, len(data))
+        self.worker.flush()
 
         self.assertEqual(b('').join(output), conn.sendData)
 
@@ -296,6 +312,170 @@ class WSGIWorkerTest(unittest.TestCase):
         # Nothing to test, just including this for completeness.
         pass
 
+    def _buildEnviron(self, head, body):
+        self.worker.conn = conn = FakeConn()
+        sock_file = StringIO(b('POST /upload HTTP/1.1\r\n') + b(head) +
+                             b('\r\n') + b(body) + b('GET / HTTP/1.1\r\n'))
+        environ = self.worker.build_environ(sock_file, conn)
+        return environ, sock_file
+
+    def testContentLengthInput(self):
+        environ, sock_file = self._buildEnviron('Content-Length: 4\r\n',
+                                                'body')
+
+        # The application can't read past the body
+        self.assertEqual(environ['wsgi.input'].read(), b('body'))
+        self.assertEqual(environ['wsgi.input'].read(), b(''))
+        self.assertEqual(sock_file.readline(), b('GET / HTTP/1.1\r\n'))
+
+        # Nor can it read a body that isn't there
+        environ, sock_file = self._buildEnviron('', '')
+        self.assertEqual(environ['wsgi.input'].read(10), b(''))
+
+        # What the application didn't read is drained
+        environ, sock_file = self._buildEnviron('Content-Length: 4\r\n',
+                                                'body')
+        self.assertTrue(environ['wsgi.input'].drain(4))
+        self.assertEqual(sock_file.readline(), b('GET / HTTP/1.1\r\n'))
+
+        environ, sock_file = self._buildEnviron('Content-Length: 4\r\n',
+                                                'body')
+        self.assertTrue(not environ['wsgi.input'].drain(3))
+
+    def testChunkedInput(self):
+        environ, sock_file = self._buildEnviron('Transfer-Encoding: chunked\r\n',
+                                                '3\r\none\r\n3\r\ntwo\r\n0\r\n\r\n')
+
+        self.assertEqual(environ['CONTENT_LENGTH'], '6')
+        self.assertTrue('HTTP_TRANSFER_ENCODING' not in environ)
+        self.assertEqual(environ['wsgi.input'].read(), b('onetwo'))
+        self.assertEqual(sock_file.readline(), b('GET / HTTP/1.1\r\n'))
+
+    def testSpooledInput(self):
+        self.worker.spool_size = 2
+        environ, sock_file = self._buildEnviron('Content-Length: 4\r\n',
+                                                'body')
+
+        # The body was read before the application got it
+        self.assertEqual(sock_file.readline(), b('GET / HTTP/1.1\r\n'))
+        self.assertEqual(environ['wsgi.input'].read(), b('body'))
+        environ['wsgi.input'].close()
+
+    def testBadContentLength(self):
+        self.worker.max_body_size = 3
+        # A superscript two, which isdigit() accepts
+        superscript = 'Content-Length: \xb2\r\n'
+        if not isinstance(superscript, bytes):
+            superscript = superscript.encode('ISO-8859-1')
+
+        for head in ('Content-Length: 4\r\n', 'Content-Length: -1\r\n',
+                     superscript, 'Content-Length: 1 2\r\n'):
+            self.assertRaises(wsgi.BadRequest,
+                              self._buildEnviron, head, 'body')
+
+    def testSendHeaders(self):
+        self.worker.conn = FakeConn()
+        self.worker.environ = self.worker.build_environ(self.worker.conn.makefile(),
+                                                        self.worker.conn)
+        self.worker.start_response('200 OK', [('Content-Type', 'text/plain'),
+                                              ('Connection', 'close')])
+        self.worker.send_headers(b('OK'), 1)
+
+        lines = self.worker.out_buffer[0].split(b('\r\n'))
+        self.assertEqual(lines[:3], [b('HTTP/1.1 200 OK'),
+                                     b('Content-Type: text/plain'),
+                                     b('Connection: close')])
+        self.assertTrue(lines[3].startswith(b('Date: ')))
+        self.assertEqual(lines[4:], [b('Server: ') + b(HTTP_SERVER_SOFTWARE),
+                                     b('Content-Length: 2'), b(''), b('')])
+        self.assertTrue(self.worker.closeConnection)
+
+        # Headers that can't be sent become a 500
+        self.worker.header_data = None
+        self.worker.start_response('200 OK', [('X-Euro', u'\u20ac')])
+        self.assertEqual(self.worker.error[0], '500 Internal Server Error')
+
+    def testBadChunkedInput(self):
+        self.worker.max_chunk_size = 4
+        self.worker.max_body_size = 6
+        for body, status in [('5\r\nabcde\r\n0\r\n\r\n', '413'),
+                             ('4\r\nabcd\r\n4\r\nabcd\r\n0\r\n\r\n', '413'),
+                             ('zz\r\n\r\n', '400'),
+                             ('+0x2\r\nab\r\n0\r\n\r\n', '400')]:
+            self.assertRaises(wsgi.BadRequest, self._buildEnviron,
+                              'Transfer-Encoding: chunked\r\n', body)
+            self.assertTrue(self.worker.conn.sendData.startswith(b('HTTP/1.1 ' + status)),
+                            msg=repr(self.worker.conn.sendData))
+
+    def _runApp(self, app):
+        self.worker.app = app
+        self.worker.conn = conn = FakeConn()
+        conn.reader = lambda: StringIO(b('GET / HTTP/1.1\r\n\r\n'))
+        self.worker.run_app(conn)
+        return conn.writes
+
+    def testCoalescedOutput(self):
+        def list_app(environ, start_response):
+            start_response('200 OK', [('Content-Type', 'text/plain')])
+            return [b('one'), b('two')]
+
+        # Headers and a body that was ready all at once go out together.
+        writes = self._runApp(list_app)
+        self.assertEqual(len(writes), 1)
+        self.assertTrue(writes[0][0].startswith(b('HTTP/1.1 200 OK\r\n')))
+        self.assertEqual(writes[0][1:], [b('6\r\n'), b('one'), b('two'),
+                                         b('\r\n'), b('0\r\n\r\n')])
+
+        def generator_app(environ, start_response):
+            start_response('200 OK', [('Content-Type', 'text/plain'),
+                                      ('Content-Length', '6')])
+            yield b('one')
+            yield b('two')
+
+        # Each piece a generator yields is sent before asking for the next.
+        writes = self._runApp(generator_app)
+        self.assertEqual(len(writes), 2)
+        self.assertTrue(writes[0][0].startswith(b('HTTP/1.1 200 OK\r\n')))
+        self.assertEqual(writes[0][1:], [b('one')])
+        self.assertEqual(writes[1], [b('two')])
+
+        def big_app(environ, start_response):
+            start_response('200 OK', [('Content-Type', 'text/plain'),
+                                      ('Content-Length', '%i' % (wsgi.WRITE_BUFFER_SIZE + 1))])
+            return [b('x') * wsgi.WRITE_BUFFER_SIZE, b('x')]
+
+        # Past the threshold, output doesn't wait for the rest of a list.
+        writes = self._runApp(big_app)
+        self.assertEqual(len(writes), 2)
+        self.assertEqual(writes[1], [b('x')])
+
+    def testChunkedOutput(self):
+        def generator_app(environ, start_response):
+            start_response('200 OK', [('Content-Type', 'text/plain')])
+            yield b('one')
+            yield b('')
+            yield b('three')
+
+        # Each piece a generator yields is a chunk of its own
+        writes = self._runApp(generator_app)
+        self.assertTrue(b('Transfer-Encoding: Chunked\r\n') in writes[0][0])
+        self.assertEqual(writes[0][1:], [b('3\r\n'), b('one'), b('\r\n')])
+        self.assertEqual(writes[1:], [[b('5\r\n'), b('three'), b('\r\n')],
+                                      [b('0\r\n\r\n')]])
+
+        def list_app(environ, start_response):
+            start_response('200 OK', [('Content-Type', 'text/plain')])
+            return [b('a'), b('bb'), b('ccc'), b('dddd')]
+
+        # The pieces of a list are merged into chunks of write_buffer_size.
+        # The headers alone fill the first.
+        self.worker.write_buffer_size = 4
+        writes = self._runApp(list_app)
+        self.assertEqual(writes[0][1:], [b('1\r\n'), b('a'), b('\r\n')])
+        self.assertEqual(writes[1:], [[b('5\r\n'), b('bb'), b('ccc'), b('\r\n')],
+                                      [b('4\r\n'), b('dddd'), b('\r\n')],
+                                      [b('0\r\n\r\n')]])
+
     def tearDown(self):
         del self.worker
 